@@ -0,0 +1,54 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from metrics import metrics
+
+
+class Overloaded(Exception):
+    """ Raised when a request is shed instead of waiting for capacity. """
+
+
+class AdmissionController:
+    """
+    Caps how many requests run at once.
+
+    Requests beyond ``limit`` wait at most ``max_wait`` seconds for a slot, and
+    at most ``max_queue`` of them wait at a time, the rest are rejected right
+    away with Overloaded. Shedding early keeps response times bounded when the
+    backend is saturated, instead of every queued request timing out.
+    """
+
+    def __init__(self, name: str, limit: int, max_wait: float, max_queue: int):
+        self.name = name
+        self.limit = limit
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def admit(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                self._reject("timeout")
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def _reject(self, reason: str):
+        metrics.inc("admission_rejected_total", pool=self.name, reason=reason)
+        raise Overloaded(f"{self.name} is overloaded ({reason})")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+from collections import deque
+
+import lavalink
+
+from history import PlayHistory
+from metrics import metrics
+from queued_track import QueuedTrack
+
+log = logging.getLogger(__name__)
+
+
+def related_query(track: lavalink.AudioTrack) -> str:
+    """ Query for tracks related to ``track``: its YouTube mix, or a search for its artist and title. """
+    if track.source_name == "youtube":
+        return f"https://www.youtube.com/watch?v={track.identifier}&list=RD{track.identifier}"
+    return f"ytsearch:{track.author} {track.title}"
+
+
+class Autoplay:
+    """
+    Keeps a guild's music going with related tracks once its queue runs dry.
+
+    When the last queued track starts, tracks related to it are resolved in the
+    background and kept as candidates. One is only queued once that track is
+    within ``window`` seconds of its end and the queue is still empty, so songs
+    requested meanwhile play first, and the candidate is still prefetched like
+    any other entry. Recently played tracks are never picked again.
+    """
+
+    def __init__(self, history: PlayHistory, resolve, batch: int = 5, window: float = 20):
+        self.history = history
+        # Coroutine function (player, query) -> LoadResult
+        self.resolve = resolve
+        self.batch = batch
+        self.window = window
+        self._candidates: dict[int, deque[QueuedTrack]] = {}
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def on_track_start(self, player):
+        """ Start resolving related tracks if the one that just started is the last one. """
+        if not self._running_dry(player):
+            return
+        if not self._candidates.get(player.guild_id):
+            self._refill(player, player.current)
+
+    def on_position(self, player):
+        """ Called on player updates, queues a related track once the last one is about to end. """
+        current = player.current
+        if not self._running_dry(player) or current.is_stream:
+            return
+        if current.duration - player.position <= self.window * 1000:
+            self._queue_candidate(player)
+
+    async def on_queue_end(self, player, seed: lavalink.AudioTrack | None):
+        """ The queue ran out before a related track was ready, wait for one and play it. """
+        if not self.history.autoplay(player.guild_id) or seed is None:
+            return
+        if not self._candidates.get(player.guild_id):
+            await asyncio.wait({self._tasks.get(player.guild_id) or self._refill(player, seed)})
+        if player.is_connected and not player.is_playing and self._queue_candidate(player):
+            await player.play()
+
+    def discard(self, guild_id: int):
+        """ Forget the candidates of a guild that turned autoplay off or was destroyed. """
+        self._candidates.pop(guild_id, None)
+        task = self._tasks.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+
+    def _running_dry(self, player) -> bool:
+        return self.history.autoplay(player.guild_id) and not player.queue and not player.loop \
+            and player.current is not None
+
+    def _queue_candidate(self, player) -> bool:
+        candidates = self._candidates.get(player.guild_id)
+        if not candidates:
+            return False
+        player.add(candidates.popleft())
+        metrics.inc("autoplay_tracks_total")
+        if not candidates:
+            # Resolve the next batch now, long before this one ends
+            self._refill(player, player.current)
+        return True
+
+    def _refill(self, player, seed: lavalink.AudioTrack | None) -> asyncio.Task | None:
+        if seed is None or player.guild_id in self._tasks:
+            return self._tasks.get(player.guild_id)
+        task = asyncio.create_task(self._resolve(player, seed))
+        self._tasks[player.guild_id] = task
+        task.add_done_callback(lambda _: self._done(player.guild_id, task))
+        return task
+
+    def _done(self, guild_id: int, task: asyncio.Task):
+        if self._tasks.get(guild_id) is task:
+            del self._tasks[guild_id]
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Error while resolving autoplay tracks for guild {guild_id}: {task.exception()}")
+
+    async def _resolve(self, player, seed: lavalink.AudioTrack):
+        result = await self.resolve(player, related_query(seed))
+        if result.load_type not in (lavalink.LoadType.PLAYLIST, lavalink.LoadType.SEARCH):
+            return
+
+        exclude = self.history.recent_identifiers(player.guild_id)
+        exclude.add(seed.identifier)
+        exclude.update(entry.identifier for entry in player.queue)
+        candidates = deque(maxlen=self.batch)
+        for track in result.tracks:
+            if track.identifier in exclude or track.is_stream:
+                continue
+            exclude.add(track.identifier)
+            candidates.append(QueuedTrack.from_track(track))
+            if len(candidates) == self.batch:
+                break
+        self._candidates[player.guild_id] = candidates
+
+        # The last track may already be within the window, it only gets one more update before it ends
+        if self._running_dry(player):
+            self.on_position(player)
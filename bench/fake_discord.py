@@ -0,0 +1,141 @@
+"""
+Stand-ins for the parts of discord.py the command handlers touch: interactions,
+members, guilds and voice channels. Connecting to a voice channel replays the
+VOICE_STATE_UPDATE and VOICE_SERVER_UPDATE a real gateway would send, so the
+Lavalink player receives its voice details exactly like in production.
+"""
+import itertools
+import time
+from types import SimpleNamespace
+
+import discord
+
+_ids = itertools.count(10 ** 17)
+
+
+def next_id() -> int:
+    return next(_ids)
+
+
+class FakeMessage:
+    def __init__(self, content=None, embed=None):
+        self.id = next_id()
+        self.content = content
+        self.embed = embed
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.deferred_at = None
+
+    async def defer(self, ephemeral: bool = False, thinking: bool = False):
+        self.deferred_at = time.perf_counter()
+
+    async def edit_message(self, **kwargs):
+        pass
+
+    async def send_message(self, content=None, **kwargs):
+        self.interaction.messages.append(FakeMessage(content, kwargs.get("embed")))
+
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content=None, *, embed=None, view=None, wait=False, ephemeral=False, **kwargs):
+        message = FakeMessage(content, embed)
+        self.interaction.messages.append(message)
+        if view is not None:
+            view.stop()
+        return message if wait else None
+
+
+class FakeInteraction:
+    """ A slash command invocation by ``user`` in ``guild``. """
+
+    def __init__(self, user: "FakeMember", guild: "FakeGuild", channel=None):
+        self.id = next_id()
+        self.user = user
+        self.guild = guild
+        self.channel = channel
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.messages: list[FakeMessage] = []
+
+
+class FakeMember:
+    def __init__(self, guild: "FakeGuild", bot: bool = False):
+        self.id = next_id()
+        self.guild = guild
+        self.bot = bot
+        self.voice = None
+        self.display_name = f"user-{self.id}"
+        self.guild_permissions = discord.Permissions.all()
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild: "FakeGuild", rtc_region: str | None = None):
+        self.id = next_id()
+        self.guild = guild
+        self.rtc_region = rtc_region
+        self.user_limit = 0
+        self.members: list[FakeMember] = []
+
+    def permissions_for(self, member) -> discord.Permissions:
+        return discord.Permissions.all()
+
+    def _get_voice_client_key(self) -> tuple[int, str]:
+        return self.guild.id, "guild_id"
+
+    def join(self, member: FakeMember):
+        member.voice = SimpleNamespace(channel=self)
+        self.members.append(member)
+
+    async def connect(self, *, cls, self_deaf: bool = False, self_mute: bool = False, timeout: float = 60, reconnect: bool = True):
+        voice_client = cls(self.guild.client, self)
+        self.guild.voice_client = voice_client
+        await voice_client.connect(timeout=timeout, reconnect=reconnect, self_deaf=self_deaf, self_mute=self_mute)
+        return voice_client
+
+
+class FakeGuild:
+    """ A guild with one voice channel and one member in it. """
+
+    def __init__(self, client: discord.Client, rtc_region: str | None = None):
+        self.id = next_id()
+        self.client = client
+        self.unavailable = False
+        self.voice_client = None
+        self.me = FakeMember(self, bot=True)
+        self.voice_channel = FakeVoiceChannel(self, rtc_region)
+        self.member = FakeMember(self)
+        self.voice_channel.join(self.member)
+
+    def get_channel(self, channel_id: int):
+        return self.voice_channel if channel_id == self.voice_channel.id else None
+
+    def interaction(self) -> FakeInteraction:
+        return FakeInteraction(self.member, self)
+
+    async def change_voice_state(self, *, channel, self_mute: bool = False, self_deaf: bool = False):
+        """ Answer with the voice events the gateway sends after a voice state change. """
+        voice_client = self.voice_client
+        if channel is None:
+            self.voice_client = None
+            return
+        await voice_client.on_voice_state_update({
+            "guild_id": str(self.id), "channel_id": str(channel.id), "user_id": str(self.client.user.id),
+            "session_id": f"voice-{self.id}", "self_deaf": self_deaf, "self_mute": self_mute,
+        })
+        await voice_client.on_voice_server_update({
+            "guild_id": str(self.id), "token": "benchmark", "endpoint": "voice.invalid:443",
+        })
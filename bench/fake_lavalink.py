@@ -0,0 +1,232 @@
+"""
+A local stand-in for a Lavalink v4 node, speaking enough of the REST and
+websocket protocol for the bot's command handlers to run against it.
+
+    python -m bench.fake_lavalink --port 2333
+
+Queries containing ``list=`` return a playlist, queries containing ``dead``
+load nothing, and anything else resolves to a single track. Playing a track immediately emits
+TrackStartEvent, and replacing or stopping it emits TrackEndEvent. Playing
+players get a playerUpdate every ``update_interval`` seconds, like the real node.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+import zlib
+from urllib.parse import parse_qs, urlparse
+
+import lavalink
+from aiohttp import web
+
+PASSWORD = "benchmark"
+
+
+def make_track(identifier: str, title: str, length: int = 180000) -> dict:
+    info = {
+        "title": title,
+        "author": "Benchmark",
+        "length": length,
+        "identifier": identifier,
+        "isStream": False,
+        "uri": f"https://www.youtube.com/watch?v={identifier}",
+        "sourceName": "youtube",
+        "position": 0,
+        "artworkUrl": None,
+        "isrc": None,
+    }
+    _, encoded = lavalink.encode_track(info)
+    return {"encoded": encoded, "info": {**info, "isSeekable": True}, "pluginInfo": {}, "userData": {}}
+
+
+class FakeLavalink:
+    def __init__(self, playlist_size: int = 100, latency: float = 0.0, update_interval: float = 5.0):
+        self.playlist_size = playlist_size
+        self.update_interval = update_interval
+        # Simulated upstream resolution time of loadtracks, in seconds
+        self.latency = latency
+        self.sessions: dict[str, web.WebSocketResponse] = {}
+        self.players: dict[tuple[str, str], dict] = {}
+        self.requests = 0
+        self._tracks: dict[str, dict] = {}
+        self._by_encoded: dict[str, dict] = {}
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v4/websocket", self.websocket)
+        app.router.add_get("/v4/loadtracks", self.load_tracks)
+        app.router.add_get("/v4/decodetrack", self.decode_track)
+        app.router.add_post("/v4/decodetracks", self.decode_tracks)
+        app.router.add_get("/v4/info", self.info)
+        app.router.add_get("/version", self.version)
+        app.router.add_get("/v4/stats", self.stats)
+        app.router.add_patch("/v4/sessions/{session}", self.update_session)
+        app.router.add_get("/v4/sessions/{session}/players", self.get_players)
+        app.router.add_get("/v4/sessions/{session}/players/{guild}", self.get_player)
+        app.router.add_patch("/v4/sessions/{session}/players/{guild}", self.update_player)
+        app.router.add_delete("/v4/sessions/{session}/players/{guild}", self.destroy_player)
+        return app
+
+    def track(self, identifier: str) -> dict:
+        track = self._tracks.get(identifier)
+        if track is None:
+            track = self._tracks[identifier] = make_track(identifier, f"Track {identifier}")
+            self._by_encoded[track["encoded"]] = track
+        return track
+
+    def _stats(self) -> dict:
+        playing = sum(1 for player in self.players.values() if player["track"])
+        return {
+            "players": len(self.players), "playingPlayers": playing, "uptime": 0,
+            "memory": {"free": 0, "used": 0, "allocated": 0, "reservable": 0},
+            "cpu": {"cores": 1, "systemLoad": 0.0, "lavalinkLoad": 0.0},
+            "frameStats": {"sent": 0, "nulled": 0, "deficit": 0},
+        }
+
+    async def _emit(self, session: str, guild: str, payload: dict):
+        ws = self.sessions.get(session)
+        if ws is not None and not ws.closed:
+            await ws.send_json({"op": "event", "guildId": guild, **payload})
+
+    async def websocket(self, request: web.Request):
+        if request.headers.get("Authorization") != PASSWORD:
+            raise web.HTTPUnauthorized()
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        session = request.headers.get("Session-Id") or uuid.uuid4().hex[:16]
+        resumed = session in self.sessions
+        self.sessions[session] = ws
+        await ws.send_json({"op": "ready", "resumed": resumed, "sessionId": session})
+        await ws.send_json({"op": "stats", **self._stats()})
+        updates = asyncio.create_task(self._update_loop(session, ws))
+        try:
+            async for _ in ws:
+                pass
+        finally:
+            updates.cancel()
+        return ws
+
+    async def load_tracks(self, request: web.Request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        identifier = request.query.get("identifier", "")
+        # Video URLs resolve to the same track every time, so re-resolving them is stable
+        video = parse_qs(urlparse(identifier).query).get("v")
+        key = video[0] if video else str(zlib.crc32(identifier.encode()))
+        if "dead" in identifier:
+            return web.json_response({"loadType": "empty", "data": {}})
+        if "list=" in identifier:
+            tracks = [self.track(f"{key}-{i}") for i in range(self.playlist_size)]
+            data = {"info": {"name": f"Playlist {key}", "selectedTrack": -1}, "pluginInfo": {}, "tracks": tracks}
+            return web.json_response({"loadType": "playlist", "data": data})
+        return web.json_response({"loadType": "track", "data": self.track(key)})
+
+    async def decode_track(self, request: web.Request):
+        track = self._by_encoded.get(request.query.get("encodedTrack") or request.query.get("track"))
+        if track is None:
+            raise web.HTTPBadRequest()
+        return web.json_response(track)
+
+    async def decode_tracks(self, request: web.Request):
+        encoded = await request.json()
+        return web.json_response([self._by_encoded[e] for e in encoded if e in self._by_encoded])
+
+    async def info(self, request: web.Request):
+        return web.json_response({"version": {"semver": "4.0.0"}, "sourceManagers": ["youtube"], "filters": [], "plugins": []})
+
+    async def version(self, request: web.Request):
+        return web.Response(text="4.0.0")
+
+    async def stats(self, request: web.Request):
+        return web.json_response(self._stats())
+
+    async def update_session(self, request: web.Request):
+        body = await request.json()
+        return web.json_response({"resuming": body.get("resuming", False), "timeout": body.get("timeout", 60)})
+
+    def _state(self, player: dict) -> dict:
+        now = time.time()
+        position = int((now - player["started"]) * 1000) if player["track"] else 0
+        return {"time": int(now * 1000), "position": position, "connected": True, "ping": 0}
+
+    def _player_json(self, guild: str, player: dict) -> dict:
+        return {
+            "guildId": guild, "track": player["track"], "volume": player["volume"], "paused": player["paused"],
+            "state": self._state(player), "voice": player["voice"], "filters": {},
+        }
+
+    async def _player_update(self, session: str, guild: str, player: dict):
+        ws = self.sessions.get(session)
+        if ws is not None and not ws.closed:
+            await ws.send_json({"op": "playerUpdate", "guildId": guild, "state": self._state(player)})
+
+    async def _update_loop(self, session: str, ws: web.WebSocketResponse):
+        while not ws.closed:
+            await asyncio.sleep(self.update_interval)
+            for (player_session, guild), player in list(self.players.items()):
+                if player_session == session and player["track"] is not None:
+                    await self._player_update(session, guild, player)
+
+    async def get_players(self, request: web.Request):
+        session = request.match_info["session"]
+        return web.json_response([self._player_json(g, p) for (s, g), p in self.players.items() if s == session])
+
+    async def get_player(self, request: web.Request):
+        key = (request.match_info["session"], request.match_info["guild"])
+        if key not in self.players:
+            raise web.HTTPNotFound()
+        return web.json_response(self._player_json(key[1], self.players[key]))
+
+    async def update_player(self, request: web.Request):
+        session, guild = request.match_info["session"], request.match_info["guild"]
+        body = await request.json() if request.can_read_body else {}
+        player = self.players.setdefault((session, guild), {"track": None, "volume": 100, "paused": False, "voice": {}, "started": 0.0})
+        for key in ("volume", "paused", "voice"):
+            if key in body:
+                player[key] = body[key]
+
+        if "encodedTrack" in body or "track" in body:
+            encoded = body.get("encodedTrack", body.get("track", {}).get("encoded"))
+            if player["track"] is not None:
+                reason = "replaced" if encoded else "stopped"
+                await self._emit(session, guild, {"type": "TrackEndEvent", "track": player["track"], "reason": reason})
+            player["track"] = self._by_encoded.get(encoded) if encoded else None
+            if player["track"] is not None:
+                player["started"] = time.time()
+                await self._emit(session, guild, {"type": "TrackStartEvent", "track": player["track"]})
+                await self._player_update(session, guild, player)
+        return web.json_response(self._player_json(guild, player))
+
+    async def destroy_player(self, request: web.Request):
+        self.players.pop((request.match_info["session"], request.match_info["guild"]), None)
+        return web.Response(status=204)
+
+
+async def start(host: str = "127.0.0.1", port: int = 0, **kwargs) -> tuple[FakeLavalink, web.AppRunner, int]:
+    """ Start a fake node, returning it with its runner and the bound port. """
+    node = FakeLavalink(**kwargs)
+    runner = web.AppRunner(node.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return node, runner, bound_port
+
+
+async def _serve(args):
+    _, _, port = await start(args.host, args.port, playlist_size=args.playlist_size, latency=args.latency / 1000)
+    print(f"Fake Lavalink listening on {args.host}:{port}, password '{PASSWORD}'")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2333)
+    parser.add_argument("--playlist-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0, help="Simulated loadtracks latency in ms")
+    try:
+        asyncio.run(_serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
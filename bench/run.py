@@ -0,0 +1,256 @@
+"""
+Load test of the bot's command handlers against a local fake Lavalink node.
+
+    python -m bench.run --guilds 200 --rate 0.5 --duration 30
+
+Every simulated guild first runs ``/play`` to connect and start playback, then
+issues ``/play``, ``/insert``, ``/skip`` and ``/queue`` with exponentially
+distributed gaps averaging ``--rate`` commands per second, weighted by ``--mix``.
+The real callbacks in bot.py run end to end, only Discord and Lavalink are faked.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from types import SimpleNamespace
+
+import lavalink
+
+from bench import fake_lavalink
+from bench.fake_discord import FakeGuild
+
+COMMANDS = ("play", "insert", "skip", "queue")
+
+
+def parse_mix(raw: str) -> dict[str, float]:
+    """ Parse command weights like ``play=4,insert=1,skip=2,queue=3``. """
+    mix = {}
+    for part in raw.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"Unknown command '{name}', expected one of {', '.join(COMMANDS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def rss_bytes() -> int:
+    """ Current resident set size, falls back to the peak where /proc isn't available. """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def track_memory(count: int = 1000) -> dict[str, float]:
+    """ Bytes per queued track, held as full AudioTracks versus the compact queue entries. """
+    from queued_track import EncodedTrackQueue
+    payload = json.dumps([fake_lavalink.make_track(f"m{i:07d}", f"Memory test track {i}") for i in range(count)])
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tracks = [lavalink.AudioTrack(data, 0) for data in json.loads(payload)]
+    full = tracemalloc.get_traced_memory()[0] - base
+    queue = EncodedTrackQueue(tracks)
+    del tracks
+    compact = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del queue
+    return {"audio_track": full / count, "queued_track": compact / count}
+
+
+class Benchmark:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        # Commands turned away by admission control
+        self.shed: dict[str, int] = defaultdict(int)
+        self.guilds: list[FakeGuild] = []
+
+    def query(self) -> str:
+        """ Draw a query from a fixed pool so repeated queries exercise the track cache. """
+        n = self.random.randrange(self.args.distinct_queries)
+        if self.random.random() < self.args.playlist_ratio:
+            return f"https://www.youtube.com/watch?v=v{n}&list=PL{n}"
+        return f"benchmark song {n}"
+
+    async def invoke(self, guild: FakeGuild, name: str):
+        interaction = guild.interaction()
+        command = getattr(self.bot_module, name)
+        if name in ("play", "insert"):
+            kwargs = {"query": self.query()}
+        elif name == "skip":
+            kwargs = {"to": 1}
+        else:
+            kwargs = {"page": self.random.randint(1, 3)}
+
+        start = time.perf_counter()
+        await command.callback(interaction, **kwargs)
+        self.latencies[name].append(time.perf_counter() - start)
+        last = interaction.messages[-1].content if interaction.messages else None
+        if last and "error occurred" in last:
+            self.errors[name] += 1
+        elif last == self.bot_module.OVERLOADED_MESSAGE:
+            self.shed[name] += 1
+
+    async def drive(self, guild: FakeGuild, deadline: float):
+        names, weights = zip(*self.args.mix.items())
+        while True:
+            gap = self.random.expovariate(self.args.rate)
+            if time.perf_counter() + gap >= deadline:
+                return
+            await asyncio.sleep(gap)
+            await self.invoke(guild, self.random.choices(names, weights)[0])
+
+    async def setup_bot(self, host: str, port: int):
+        os.environ["LAVALINK_NODES"] = json.dumps([{"host": host, "port": port, "password": fake_lavalink.PASSWORD, "name": "bench"}])
+        os.environ["METRICS_PORT"] = "0"
+        os.environ["STATE_DB"] = os.path.join(tempfile.mkdtemp(prefix="fcmusic-bench-"), "bench.db")
+        import bot as bot_module
+        self.bot_module = bot_module
+
+        client = bot_module.bot
+        client._connection.user = SimpleNamespace(id=1, bot=True)
+        channels = {}
+        client.get_channel = channels.get
+        self.channels = channels
+        bot_module.setup_lavalink(client)
+
+        for _ in range(100):
+            if client.lavalink.node_manager.available_nodes:
+                break
+            await asyncio.sleep(0.1)
+        else:
+            raise RuntimeError(f"Fake Lavalink node at {host}:{port} never became available")
+        return client
+
+    async def run(self) -> dict:
+        args = self.args
+        runner = None
+        if args.lavalink:
+            host, _, port = args.lavalink.rpartition(":")
+            port = int(port)
+        else:
+            host = "127.0.0.1"
+            _, runner, port = await fake_lavalink.start(host, playlist_size=args.playlist_size, latency=args.latency / 1000)
+        client = await self.setup_bot(host, port)
+        metrics = self.bot_module.metrics
+        lag_task = asyncio.create_task(metrics.monitor_loop_lag(0.05))
+
+        if args.memory:
+            tracemalloc.start()
+        rss_before = rss_bytes()
+        traced_before = tracemalloc.get_traced_memory()[0] if args.memory else 0
+
+        # Every guild connects and starts playing before the measured phase
+        for _ in range(args.guilds):
+            guild = FakeGuild(client)
+            self.channels[guild.voice_channel.id] = guild.voice_channel
+            self.guilds.append(guild)
+        await asyncio.gather(*(self.invoke(guild, "play") for guild in self.guilds))
+        self.latencies.clear()
+        self.errors.clear()
+        self.shed.clear()
+
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(self.drive(guild, deadline) for guild in self.guilds))
+        elapsed = time.perf_counter() - start
+
+        players = client.lavalink.player_manager.players.values()
+        result = {
+            "guilds": args.guilds,
+            "duration": elapsed,
+            "commands": sum(len(v) for v in self.latencies.values()),
+            "errors": dict(self.errors),
+            "shed": dict(self.shed),
+            "per_command": {
+                name: {"count": len(values), "p50_ms": percentile(values, 0.5) * 1000, "p99_ms": percentile(values, 0.99) * 1000}
+                for name, values in sorted(self.latencies.items())
+            },
+            "rss_per_guild_kb": (rss_bytes() - rss_before) / args.guilds / 1024,
+            "queued_tracks": sum(len(player.queue) for player in players),
+            "loop_lag_p99_ms": (metrics.histogram("event_loop_lag_seconds") or SimpleNamespace(quantile=lambda q: 0)).quantile(0.99) * 1000,
+            "cache": self.bot_module.track_cache.stats,
+        }
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        result["commands_per_sec"] = result["commands"] / elapsed
+        result["p50_ms"] = percentile(all_latencies, 0.5) * 1000
+        result["p99_ms"] = percentile(all_latencies, 0.99) * 1000
+        if args.memory:
+            result["traced_per_guild_kb"] = (tracemalloc.get_traced_memory()[0] - traced_before) / args.guilds / 1024
+            tracemalloc.stop()
+
+        lag_task.cancel()
+        for player in players:
+            player.cancel_playlist_load()
+        await asyncio.sleep(0)
+        await client.lavalink.close()
+        if runner is not None:
+            await runner.cleanup()
+        return result
+
+
+def report(result: dict) -> str:
+    lines = [
+        f"Guilds:            {result['guilds']}",
+        f"Duration:          {result['duration']:.1f}s",
+        f"Commands:          {result['commands']} ({result['commands_per_sec']:.1f}/s)",
+        f"Latency:           p50 {result['p50_ms']:.2f}ms, p99 {result['p99_ms']:.2f}ms",
+        f"Errors:            {sum(result['errors'].values())}",
+        f"Shed:              {sum(result['shed'].values())}",
+        f"Memory per guild:  {result['rss_per_guild_kb']:.1f} KiB RSS"
+        + (f", {result['traced_per_guild_kb']:.1f} KiB traced" if "traced_per_guild_kb" in result else ""),
+        f"Queued tracks:     {result['queued_tracks']}",
+        f"Memory per track:  {result['bytes_per_track']['queued_track']:.0f} B queued"
+        f" ({result['bytes_per_track']['audio_track']:.0f} B as AudioTrack)",
+        f"Loop lag p99:      <= {result['loop_lag_p99_ms']:.0f}ms",
+        f"Track cache:       {result['cache']}",
+        "",
+        f"{'command':<10}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}",
+    ]
+    for name, stats in result["per_command"].items():
+        lines.append(f"{name:<10}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=100, help="Number of simulated guilds")
+    parser.add_argument("--rate", type=float, default=0.5, help="Average commands per second per guild")
+    parser.add_argument("--duration", type=float, default=20, help="Length of the measured phase in seconds")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("play=4,insert=1,skip=2,queue=3"),
+                        help="Command weights, e.g. play=4,insert=1,skip=2,queue=3")
+    parser.add_argument("--playlist-ratio", type=float, default=0.1, help="Share of /play and /insert queries that are playlists")
+    parser.add_argument("--playlist-size", type=int, default=100, help="Tracks per playlist returned by the fake node")
+    parser.add_argument("--distinct-queries", type=int, default=1000, help="Size of the query pool")
+    parser.add_argument("--latency", type=float, default=0, help="Simulated Lavalink loadtracks latency in ms")
+    parser.add_argument("--lavalink", help="host:port of an already running fake node (python -m bench.fake_lavalink)")
+    parser.add_argument("--memory", action="store_true", help="Also measure allocations with tracemalloc (slower)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(Benchmark(args).run())
+    result["bytes_per_track"] = track_memory()
+    print(json.dumps(result, indent=2) if args.json else report(result))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,13 @@
+import time
+# Taken before the imports below so the startup breakdown includes them
+START_TIME = time.perf_counter()
 import os
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import signal
 from dotenv import load_dotenv, find_dotenv
 from datetime import datetime
 import discord
@@ -6,6 +15,25 @@ from discord.ext import commands
 from discord import app_commands
 from discord import Interaction
 import lavalink
+import aiohttp
+from track_cache import TrackCache, normalize_query
+from nodes import NodePool, parse_nodes
+from player import Player
+from playlist_loader import PlaylistLoad, first_track_url
+from state_store import StateStore, decode_tracks
+from sharding import parse_shard_ids, shard_for_guild
+from queue_pages import QueueView, format_duration, PAGE_SIZE
+from metrics import metrics, StartupTimer
+from log_queue import setup_logging
+from idle import IdleReaper
+from guild_executor import GuildExecutor
+from prefetch import Prefetcher
+from admission import AdmissionController, Overloaded
+from now_playing import EditScheduler, NowPlayingPanels, now_playing_embed
+from suggestions import Suggester, MAX_CHOICE_LENGTH
+from history import PlayHistory, RECORDED_REASONS
+from autoplay import Autoplay
+from queued_track import QueuedTrack, decode_many
 
 """ Environment variables setup """
 # Load default environment variables
@@ -16,42 +44,222 @@ load_dotenv(".env.dev", override=True)
 LAVALINK_HOST = os.getenv("LAVALINK_HOST")
 LAVALINK_PORT = os.getenv("LAVALINK_PORT")
 LAVALINK_PW = os.getenv("LAVALINK_PW")
+LAVALINK_NODES = parse_nodes(os.getenv("LAVALINK_NODES"), LAVALINK_HOST, LAVALINK_PORT, LAVALINK_PW)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+TRACK_CACHE_SIZE = int(os.getenv("TRACK_CACHE_SIZE", 1024))
+TRACK_CACHE_TTL = float(os.getenv("TRACK_CACHE_TTL", 900))
+TRACK_CACHE_MB = int(os.getenv("TRACK_CACHE_MB", 64))
+STATE_DB = os.getenv("STATE_DB", "fcmusic.db")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 30))
+RESTORE_CONCURRENCY = int(os.getenv("RESTORE_CONCURRENCY", 5))
+# Sharding, SHARD_IDS/SHARD_COUNT are set per worker by launcher.py
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT")) if os.getenv("SHARD_COUNT") else None
+SHARDED = os.getenv("SHARDED", "false").lower() == "true" or SHARD_IDS is not None
+WORKER_ID = int(os.getenv("WORKER_ID", 0))
+# Local metrics endpoint, each worker listens on METRICS_PORT + WORKER_ID. Disabled unless METRICS_PORT is set.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Seconds before a player that isn't playing, or is alone in its channel, is disconnected
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", 300))
+ALONE_TIMEOUT = float(os.getenv("ALONE_TIMEOUT", 60))
+# Lavalink track lookups allowed in flight, extra lookups wait up to LOOKUP_MAX_WAIT seconds or are turned away
+MAX_LOOKUPS = int(os.getenv("MAX_LOOKUPS", 32))
+LOOKUP_MAX_WAIT = float(os.getenv("LOOKUP_MAX_WAIT", 5))
+LOOKUP_MAX_QUEUE = int(os.getenv("LOOKUP_MAX_QUEUE", 256))
+# Seconds before the end of a track to check the next PREFETCH_DEPTH queue entries
+PREFETCH_WINDOW = float(os.getenv("PREFETCH_WINDOW", 20))
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", 2))
+# Live now playing panels, progress is refreshed at most every PANEL_UPDATE_INTERVAL seconds
+PANEL_UPDATE_INTERVAL = float(os.getenv("PANEL_UPDATE_INTERVAL", 15))
+# Message edits per second across all panels, kept well under Discord's global rate limit
+EDIT_RATE_LIMIT = float(os.getenv("EDIT_RATE_LIMIT", 25))
+# Sync the command tree even if its schema hash hasn't changed
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "false").lower() == "true"
+# Tracks kept in the autocomplete index, and seconds an autocomplete may spend waiting on a search
+AUTOCOMPLETE_INDEX_SIZE = int(os.getenv("AUTOCOMPLETE_INDEX_SIZE", 20000))
+AUTOCOMPLETE_BUDGET = float(os.getenv("AUTOCOMPLETE_BUDGET", 2.5))
+# Played tracks remembered per guild for /history and autoplay
+HISTORY_SIZE = int(os.getenv("HISTORY_SIZE", 50))
+# Seconds Lavalink keeps a session alive for us to resume, 0 disables resuming. A disconnected node gets
+# RESUME_GRACE seconds to come back before its players are moved to another node.
+RESUME_TIMEOUT = int(os.getenv("RESUME_TIMEOUT", 60))
+RESUME_GRACE = float(os.getenv("RESUME_GRACE", 15))
+# Attempts to rejoin a voice channel after losing its voice server before giving up on the player
+VOICE_RECONNECT_ATTEMPTS = int(os.getenv("VOICE_RECONNECT_ATTEMPTS", 5))
+
+log = logging.getLogger("fcmusic")
+startup = StartupTimer(metrics, START_TIME)
+startup.mark("imports")
 
 """ Bot and Lavalink setup """
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix='!',intents=intents)
+# A single process either runs one shard, or every shard it is given with AutoShardedBot
+BotBase = commands.AutoShardedBot if SHARDED else commands.Bot
+
+class MusicBot(BotBase):
+    # Set by main() when running as a launcher.py worker
+    report_queue = None
+    # Set while closing with session resuming enabled, players are left running on Lavalink for the next run
+    keep_players = False
+
+    async def setup_hook(self):
+        # Runs once per process after login, before connecting to the gateway
+        startup.mark("login")
+        # Sessions of the previous run are resumed if Lavalink still holds them
+        if RESUME_TIMEOUT:
+            for node in LAVALINK_NODES:
+                startup_sessions[node["name"]] = await state_store.get_meta(session_key(node["name"]))
+        setup_lavalink(self)
+        startup.mark("lavalink")
+
+        # Commands are global, so only the worker running shard 0 syncs them
+        if SHARD_IDS is None or 0 in SHARD_IDS:
+            await sync_commands()
+        startup.mark("command_sync")
+
+        asyncio.create_task(metrics.monitor_loop_lag())
+        if METRICS_PORT:
+            try:
+                await metrics.serve(METRICS_HOST, METRICS_PORT + WORKER_ID)
+            except OSError as e:
+                # Metrics are optional, don't keep the bot from starting over a taken port
+                log.warning(f"Could not serve metrics on {METRICS_HOST}:{METRICS_PORT + WORKER_ID}: {e}")
+        if self.report_queue is not None:
+            asyncio.create_task(report_loop(self.report_queue))
+
+        idle_reaper.start()
+        edit_scheduler.start()
+
+        try:
+            play_history.restore(await state_store.load_history())
+        except Exception as e:
+            log.error(f"Error while loading play history: {e}")
+
+        # Restore saved players once the guild cache is ready, then start taking snapshots
+        self.snapshot_task = asyncio.create_task(restore_then_snapshot())
+
+        # Close cleanly with a final snapshot when stopped by a service manager or launcher.py
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:
+            # Not available on Windows
+            pass
+
+    async def close(self):
+        # Take a final snapshot so a restart resumes exactly where playback stopped
+        if hasattr(self, 'lavalink'):
+            await snapshot_players()
+        self.keep_players = bool(RESUME_TIMEOUT)
+        await state_store.close()
+        await super().close()
+
+# The presence is sent with IDENTIFY, instead of being changed again on every on_ready
+activity = discord.Activity(type=discord.ActivityType.listening, name="Music")
+if SHARDED:
+    bot = MusicBot(command_prefix='!', intents=intents, activity=activity, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
+else:
+    bot = MusicBot(command_prefix='!',intents=intents, activity=activity)
+
+# Caps the lookups that actually reach Lavalink, shedding load when it is saturated
+lookup_admission = AdmissionController("lavalink_lookups", limit=MAX_LOOKUPS, max_wait=LOOKUP_MAX_WAIT, max_queue=LOOKUP_MAX_QUEUE)
+
+# Shared across guilds so popular URLs and searches only hit Lavalink once
+track_cache = TrackCache(max_entries=TRACK_CACHE_SIZE, ttl=TRACK_CACHE_TTL, max_bytes=TRACK_CACHE_MB * 1024 * 1024,
+                         admission=lookup_admission)
+
+# Serializes commands that change a guild's player and coalesces duplicates
+guild_commands = GuildExecutor()
+
+# Re-resolves upcoming entries before they play, dropping the ones that went dead
+prefetcher = Prefetcher(lambda player, query: track_cache.get_tracks(player.node, query),
+                        window=PREFETCH_WINDOW, depth=PREFETCH_DEPTH)
+
+# Player state persisted across restarts
+state_store = StateStore(STATE_DB)
+
+# Disconnects idle players, with every guild's timer on one shared timer wheel
+idle_reaper = IdleReaper(bot, idle_timeout=IDLE_TIMEOUT, alone_timeout=ALONE_TIMEOUT)
+
+# Every panel edit goes through one scheduler that coalesces and rate limits them
+edit_scheduler = EditScheduler(global_rate=EDIT_RATE_LIMIT)
+now_playing_panels = NowPlayingPanels(bot, edit_scheduler, interval=PANEL_UPDATE_INTERVAL)
+
+# Recently played tracks of every guild, and the autoplay that extends a queue from them
+play_history = PlayHistory(size=HISTORY_SIZE)
+autoplayer = Autoplay(play_history, lambda player, query: track_cache.get_tracks(player.node, query),
+                      window=PREFETCH_WINDOW)
+
+# Autocomplete for queries, fed by the play history, played tracks and every result stored in the track cache
+suggester = Suggester(lambda guild_id, query: track_cache.get_tracks(search_node(guild_id), query), play_history,
+                      max_values=AUTOCOMPLETE_INDEX_SIZE, budget=AUTOCOMPLETE_BUDGET)
+track_cache.on_put = suggester.add_result
+
+# Lavalink session ids saved by the previous run, by node name
+startup_sessions: dict[str, str | None] = {}
+
+def session_key(node_name: str) -> str:
+    return f"lavalink_session:{WORKER_ID}:{node_name}"
+
+# Helper function to check whether a guild is served by this process
+def owns_guild(guild_id: int) -> bool:
+    if SHARD_IDS is None:
+        return True
+    return shard_for_guild(guild_id, SHARD_COUNT) in SHARD_IDS
+
+# Lavalink Client Setup, called from setup_hook and shared with LavalinkClient
+def setup_lavalink(client: discord.Client) -> lavalink.Client:
+    """ Create the Lavalink client and node pool on the bot object if it doesn't exist yet. """
+    if hasattr(client, 'lavalink'):
+        return client.lavalink
+
+    client.lavalink = lavalink.Client(client.user.id, player=Player)
+    # Swap in a session that traces REST latency and errors, before any node captures it
+    default_session = client.lavalink._session
+    client.lavalink._session = aiohttp.ClientSession(trace_configs=[metrics.trace_config()])
+    asyncio.get_running_loop().create_task(default_session.close())
+    client.lavalink.node_manager = NodePool(client.lavalink, resume_grace=RESUME_GRACE if RESUME_TIMEOUT else 0)
+    for node in LAVALINK_NODES:
+        client.lavalink.add_node(**node, session_id=startup_sessions.get(node["name"]))
+
+    # Register the module level Lavalink listeners
+    for hook in (on_node_ready, on_node_disconnect, on_queue_end, on_track_start, on_track_end, on_player_update):
+        for event in hook._lavalink_events:
+            client.lavalink.add_event_hook(hook, event=event)
+    return client.lavalink
 
-# Lavalink Client Setup
 class LavalinkClient(discord.VoiceProtocol):
     def __init__(self, client: discord.Client, channel: discord.abc.Connectable):
         self.client = client
         self.channel = channel
         self.guild_id = channel.guild.id
         self._destroyed = False
+        # Set when leaving on purpose, stops a reconnect in progress
+        self._disconnecting = False
+        self._self_deaf = False
+        self._reconnect_task: asyncio.Task | None = None
+        # Set whenever Discord assigns a voice server
+        self._rejoined = asyncio.Event()
 
-        # Ensure Lavalink client exists on the bot object
-        if not hasattr(self.client, 'lavalink'):
-            self.client.lavalink = lavalink.Client(client.user.id)
-            self.client.lavalink.add_node(
-                host=LAVALINK_HOST,
-                port=LAVALINK_PORT,
-                password=LAVALINK_PW,
-                region="hk",
-                name='default-node'
-            )
-        # Shorthand for lavalink client
-        self.lavalink: lavalink.Client = self.client.lavalink
+        # Ensure Lavalink client exists on the bot object, shorthand for lavalink client
+        self.lavalink: lavalink.Client = setup_lavalink(self.client)
 
     async def on_voice_server_update(self, data):
+        # The voice server went away, Discord normally assigns a new one shortly
+        if data.get('endpoint') is None:
+            if self._reconnect_task is None or self._reconnect_task.done():
+                self._reconnect_task = asyncio.create_task(self._reconnect())
+            return
+        self._rejoined.set()
+
         lavalink_data = {'t': 'VOICE_SERVER_UPDATE', 'd': data}
         await self.lavalink.voice_update_handler(lavalink_data)
 
     async def on_voice_state_update(self, data):
         channel_id = data['channel_id']
 
-        # If the bot disconnects, handle cleanup
+        # If the bot disconnects, handle cleanup. This is also how a moderator disconnecting the bot looks, so never rejoin.
         if not channel_id:
             await self._destroy()
             return
@@ -65,12 +273,52 @@ class LavalinkClient(discord.VoiceProtocol):
     async def connect(self, *, timeout: float, reconnect: bool, self_deaf: bool = False, self_mute: bool = False) -> None:
         """ Connect the bot to the voice channel and create a player_manager if needed. """
         # Ensure player instance exists.
-        self.lavalink.player_manager.create(guild_id=self.channel.guild.id)
+        create_player(self.channel.guild.id, self.channel)
+        self._self_deaf = self_deaf
         # Use discord.py's state change to establish connection.
         await self.channel.guild.change_voice_state(channel=self.channel, self_mute=self_mute, self_deaf=self_deaf)
 
+    async def _reconnect(self):
+        """ Wait for a new voice server, rejoining the channel if none comes, keeping the player and its position. """
+        log.warning(f"Lost voice server in guild {self.guild_id}, waiting for a new one")
+        self._rejoined.clear()
+        # Every attempt is followed by one more wait for its voice server
+        for attempt in range(VOICE_RECONNECT_ATTEMPTS + 1):
+            try:
+                await asyncio.wait_for(self._rejoined.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+            else:
+                # Lavalink gets the new voice server through the usual update
+                metrics.inc("voice_reconnects_total", result="reconnected")
+                log.info(f"Reconnected voice in guild {self.guild_id}")
+                return
+            if attempt == VOICE_RECONNECT_ATTEMPTS:
+                break
+
+            # Jittered backoff spreads out the rejoins of every guild dropped by the same outage
+            await asyncio.sleep(backoff(attempt))
+            if self._destroyed or self._disconnecting:
+                return
+            channel = self.client.get_channel(self.channel.id)
+            # Nobody left to rejoin for
+            if channel is None or not any(not member.bot for member in channel.members):
+                break
+            try:
+                await channel.guild.change_voice_state(channel=channel, self_deaf=self._self_deaf)
+            except (discord.HTTPException, discord.ClientException) as e:
+                log.warning(f"Voice reconnect attempt {attempt + 1} failed in guild {self.guild_id}: {e}")
+
+        metrics.inc("voice_reconnects_total", result="gave_up")
+        log.warning(f"Giving up on the voice connection in guild {self.guild_id}")
+        await self.disconnect(force=True)
+
     async def disconnect(self, *, force: bool = False) -> None:
         """ Handles the disconnect. Cleans up running player and leaves the voice client. """
+        # Shutting down, the next run resumes the session and picks the player up where it is
+        if self.client.keep_players:
+            return
+
         player = self.lavalink.player_manager.get(self.channel.guild.id)
 
         # If the player is not connected, do nothing.
@@ -78,6 +326,7 @@ class LavalinkClient(discord.VoiceProtocol):
             return
 
         # Use discord.py's state change to disconnect.
+        self._disconnecting = True
         await self.channel.guild.change_voice_state(channel=None)
 
         # Update player state and cleanup resources.
@@ -86,52 +335,256 @@ class LavalinkClient(discord.VoiceProtocol):
 
     async def _destroy(self):
         """ Internal cleanup method. """
-        if self._destroyed:
+        if self._destroyed or self.client.keep_players:
             return
         self._destroyed = True
 
         self.cleanup() # discord.py internal cleanup
+        if self._reconnect_task is not None and self._reconnect_task is not asyncio.current_task():
+            self._reconnect_task.cancel()
+        now_playing_panels.close(self.guild_id)
+        prefetcher.discard(self.guild_id)
+        autoplayer.discard(self.guild_id)
 
         try:
             await self.lavalink.player_manager.destroy(self.guild_id)
         except lavalink.errors.ClientError:
             pass
 
+async def sync_commands():
+    """ Sync the command tree, skipped if its schema is unchanged since the last sync. """
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    key = f"command_hash:{bot.application_id}"
+    try:
+        if not FORCE_COMMAND_SYNC and await state_store.get_meta(key) == digest:
+            log.info("Command tree unchanged, skipping sync")
+            return
+        synced = await bot.tree.sync()
+        await state_store.set_meta(key, digest)
+        log.info(f'Synced {len(synced)} commands')
+    except Exception as e:
+        log.error(f"Error while syncing commands: {e}")
+
+# Cold start is over once both the gateway and a Lavalink node are ready
+def mark_playable():
+    if "first_playable" not in startup.phases and {"gateway_ready", "node_ready"} <= startup.phases.keys():
+        startup.mark("first_playable")
+        log.info(f"Startup: {startup.summary()}")
+
 # Bot event listeners
 @bot.event
 async def on_ready():
-    print(f'Logged on as {bot.user}')
-    await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name="Music"))
-
-    # Initialize Lavalink client
-    if not hasattr(bot, 'lavalink'):
-        bot.lavalink = lavalink.Client(bot.user.id)
-        bot.lavalink.add_node(
-            host=LAVALINK_HOST,
-            port=LAVALINK_PORT,
-            password=LAVALINK_PW,
-            region="hk",
-            name='default-node'
-        )
-
-    # Add event listeners (hooks) to the Lavalink client instance
-    bot.lavalink.add_event_hooks(bot)
-
-    synced = await bot.tree.sync()
-    print(f'Synced {len(synced)} commands')
+    # Also fires after gateway reconnects, so keep this cheap
+    log.info(f'Logged on as {bot.user}')
+    startup.mark("gateway_ready")
+    mark_playable()
+
+# Any command counts as activity and postpones the idle check
+@bot.listen()
+async def on_interaction(interaction: Interaction):
+    if interaction.guild_id:
+        idle_reaper.touch(interaction.guild_id)
+
+@bot.listen()
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    voice_client = member.guild.voice_client
+    if member.bot or voice_client is None or voice_client.channel not in (before.channel, after.channel):
+        return
+    # Someone left or joined the bot's channel
+    if any(not m.bot for m in voice_client.channel.members):
+        idle_reaper.touch(member.guild.id)
+    else:
+        idle_reaper.alone(member.guild.id)
+
+# Player state snapshots
+# Guilds with a saved snapshot that hasn't been restored yet, their rows are kept by snapshots
+pending_restores: set[int] = set()
+
+async def snapshot_players():
+    try:
+        await state_store.save(list(bot.lavalink.player_manager.players.values()),
+                               owns=lambda guild_id: owns_guild(guild_id) and guild_id not in pending_restores)
+        history = play_history.dirty_rows()
+        try:
+            await state_store.save_history(history)
+        except Exception:
+            play_history.mark_dirty(guild_id for guild_id, _, _ in history)
+            raise
+    except Exception as e:
+        log.error(f"Error while saving player snapshots: {e}")
+
+async def snapshot_loop():
+    while not bot.is_closed():
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        await snapshot_players()
+
+async def restore_then_snapshot():
+    try:
+        await restore_players()
+    except Exception as e:
+        log.error(f"Error while restoring players: {e}")
+    await snapshot_loop()
+
+async def restore_players():
+    """ Reconnect and rebuild the players saved before the last restart, a few at a time. """
+    await bot.wait_until_ready()
+    snapshots = await state_store.load()
+    if not snapshots:
+        return
+    pending_restores.update(snapshot.guild_id for snapshot in snapshots if owns_guild(snapshot.guild_id))
+
+    # Players can only be created once a node is available
+    for _ in range(30):
+        if bot.lavalink.node_manager.available_nodes:
+            break
+        await asyncio.sleep(1)
+    else:
+        log.warning("No Lavalink Node available, skipping player restore")
+        return
+
+    log.info(f"Restoring {len(snapshots)} players")
+    semaphore = asyncio.Semaphore(RESTORE_CONCURRENCY)
+
+    async def restore(snapshot):
+        async with semaphore:
+            try:
+                if await restore_player(snapshot):
+                    pending_restores.discard(snapshot.guild_id)
+            except Exception as e:
+                log.error(f"Error while restoring player {snapshot.guild_id}: {e}")
+            # Pace voice connections so a restart doesn't flood the gateway or Lavalink
+            await asyncio.sleep(1)
+
+    await asyncio.gather(*(restore(snapshot) for snapshot in snapshots))
+    log.info(f"Restored {len(bot.lavalink.player_manager.players)} players")
+
+async def restore_player(snapshot) -> bool:
+    """ Restore a saved player. Returns False if its guild is unavailable and the snapshot should be kept. """
+    # Guilds on other workers' shards are restored by those workers
+    if not owns_guild(snapshot.guild_id):
+        return True
+    guild = bot.get_guild(snapshot.guild_id)
+    if guild is None or guild.unavailable:
+        return False
+    channel = guild.get_channel(snapshot.channel_id)
+    if channel is None or guild.voice_client:
+        return True
+    # Nobody left to listen
+    if not any(not member.bot for member in channel.members):
+        return True
+
+    player = create_player(guild.id, channel)
+    player.add_many(await decode_tracks(player.node, snapshot.queue))
+    player.loop = snapshot.loop
+    player.shuffle = snapshot.shuffle
+    await channel.connect(cls=LavalinkClient, self_deaf=True)
+
+    current = await decode_tracks(player.node, [(snapshot.current, snapshot.current_requester)]) if snapshot.current else []
+    if current:
+        track = current[0]
+        live = await resumed_player(player, track)
+        if live is not None:
+            # Lavalink kept playing through the restart, pick up from where it is now
+            player.current = track
+            player.volume = live["volume"]
+            player.paused = live["paused"]
+            await player.update_state(live["state"])
+            return True
+        start_time = snapshot.position if 0 <= snapshot.position < track.duration else 0
+        await player.play(track, start_time=start_time, volume=snapshot.volume, pause=snapshot.paused)
+    elif player.queue:
+        await player.play(volume=snapshot.volume)
+    return True
+
+async def resumed_player(player: Player, track: lavalink.AudioTrack) -> dict | None:
+    """ Return the node's state of a player still playing ``track`` in a session resumed from the previous run. """
+    if not RESUME_TIMEOUT or player.node.session_id != startup_sessions.get(player.node.name):
+        return None
+    try:
+        live = await player.node.get_player(player.guild_id)
+    except (lavalink.errors.RequestError, lavalink.errors.ClientError):
+        return None
+    if not live or not live.get("track") or live["track"]["encoded"] != track.track:
+        return None
+    return live
 
 # Lavalink event listeners
 @lavalink.listener(lavalink.events.NodeReadyEvent)
 async def on_node_ready(event: lavalink.events.NodeReadyEvent):
-    print(f"Lavalink Node '{event.node.name}' is ready! Available: {event.node.available}")
+    log.info(f"Lavalink Node '{event.node.name}' is ready! Available: {event.node.available}, Resumed: {event.resumed}")
+    startup.mark("node_ready")
+    mark_playable()
+
+    # A new session has to be made resumable, and remembered for the next run
+    if RESUME_TIMEOUT and not event.resumed:
+        try:
+            await event.node.update_session(resuming=True, timeout=RESUME_TIMEOUT)
+            await state_store.set_meta(session_key(event.node.name), event.session_id)
+        except Exception as e:
+            log.error(f"Error while enabling session resuming on Lavalink Node '{event.node.name}': {e}")
 
 @lavalink.listener(lavalink.events.NodeDisconnectedEvent)
 async def on_node_disconnect(event: lavalink.events.NodeDisconnectedEvent):
-    print(f"Lavalink Node '{event.node.name}' disconnected! Reason: {event.reason}, Code: {event.code}")
+    # Players on the node are moved or kept for resuming by the node pool before this is dispatched
+    log.warning(f"Lavalink Node '{event.node.name}' disconnected! Reason: {event.reason}, Code: {event.code}")
+
+@lavalink.listener(lavalink.events.QueueEndEvent)
+async def on_queue_end(event: lavalink.events.QueueEndEvent):
+    idle_reaper.touch(event.player.guild_id)
+    now_playing_panels.update(event.player.guild_id)
+    last = play_history.entry(event.player.guild_id, 1)
+    # Falls back to the node for tracks the local decoder can't read, like /history
+    seed = (await decode_many(event.player.node, [(last.encoded, last.requester)]))[0] if last else None
+    await autoplayer.on_queue_end(event.player, seed)
+
+@lavalink.listener(lavalink.events.TrackStartEvent)
+async def on_track_start(event: lavalink.events.TrackStartEvent):
+    now_playing_panels.update(event.player.guild_id)
+    suggester.add_track(event.track)
+    autoplayer.on_track_start(event.player)
+
+@lavalink.listener(lavalink.events.TrackEndEvent)
+async def on_track_end(event: lavalink.events.TrackEndEvent):
+    if event.track is not None and event.reason in RECORDED_REASONS:
+        play_history.record(event.player.guild_id, event.track)
+
+@lavalink.listener(lavalink.events.PlayerUpdateEvent)
+async def on_player_update(event: lavalink.events.PlayerUpdateEvent):
+    now_playing_panels.update(event.player.guild_id, progress=True)
+    # Autoplay first, so a related track it queues is prefetched right away
+    autoplayer.on_position(event.player)
+    prefetcher.on_position(event.player)
+
+# Helper function to create a player on the least loaded node, preferring the voice channel's region
+def create_player(guild_id: int, channel: discord.abc.Connectable = None) -> Player:
+    region = bot.lavalink.node_manager.region_for(getattr(channel, 'rtc_region', None))
+    return bot.lavalink.player_manager.create(guild_id, region=region)
+
+# Helper function to pick a node for searches that don't need a player, without counting it as a placement
+def search_node(guild_id: int) -> lavalink.Node:
+    player = bot.lavalink.player_manager.get(guild_id)
+    if player is not None and player.node is not None and player.node.available:
+        return player.node
+    nodes = bot.lavalink.node_manager.available_nodes
+    if not nodes:
+        raise lavalink.errors.ClientError("No available nodes")
+    return min(nodes, key=bot.lavalink.node_manager.load)
+
+# Helper function to pick a reconnect delay, exponential backoff with full jitter
+def backoff(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+# Helper function to acknowledge an interaction, timed separately from the rest of the command
+@metrics.timed_segment("defer")
+async def defer(interaction: Interaction, ephemeral: bool = False):
+    await interaction.response.defer(ephemeral=ephemeral)
 
 # Helper function to create a player and ensure the bot is connected to a voice channel
+@metrics.timed_segment("ensure_voice")
 async def ensure_voice(interaction: Interaction, user_should_connect: bool, bot_should_connect: bool = True):
-    player = bot.lavalink.player_manager.create(interaction.guild.id)
+    voice = interaction.user.voice
+    player = create_player(interaction.guild.id, voice.channel if voice else None)
 
     if (not interaction.user.voice or not interaction.user.voice.channel) and user_should_connect:
         raise app_commands.AppCommandError('Please join a voice channel first.')
@@ -158,88 +611,140 @@ async def ensure_voice(interaction: Interaction, user_should_connect: bool, bot_
 
     return player
 
+# Helper function to parse a 1-indexed index or range like "5-200" into a 0-indexed [start, stop) span
+def parse_range(text: str, length: int) -> tuple[int, int] | None:
+    first, _, last = text.replace(" ", "").partition("-")
+    try:
+        start = int(first)
+        stop = int(last) if last else start
+    except ValueError:
+        return None
+    if not 1 <= start <= stop or start > length:
+        return None
+    return start - 1, min(stop, length)
+
+# Helper function to resolve a query through the shared track cache
+@metrics.timed_segment("get_tracks")
+async def get_tracks(player: Player, query: str) -> lavalink.LoadResult:
+    return await track_cache.get_tracks(player.node, query)
+
 """ Bot Commands """
+# Reply to a command that was coalesced with an identical one already in progress
+COALESCED_MESSAGE = "The same command was just used in this server, so it was only done once."
+OVERLOADED_MESSAGE = "The music server is busy right now, please try again in a moment."
+
 @bot.tree.command(name="play", description="Play the song or resume playback")
 @app_commands.describe(query="URL or search query")
+@metrics.timed
 async def play(interaction: Interaction, query: str=None):
-    await interaction.response.defer()
+    await defer(interaction)
 
-    try:
+    async with guild_commands.run(interaction.guild.id, key="resume" if query is None else None) as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
 
-        # --- Resume Logic ---
-        if query is None:
-            player = await ensure_voice(interaction, user_should_connect=True)
-            if not player.paused:
-                await interaction.followup.send("Song is already playing.")
-                return
-            elif player.paused:
-                await player.set_pause(False)
-                await interaction.followup.send("Song resumed.")
-                return
-            else:
-                await interaction.followup.send("No song is playing.")
-                return
+            # --- Resume Logic ---
+            if query is None:
+                player = await ensure_voice(interaction, user_should_connect=True)
+                if not player.paused:
+                    await interaction.followup.send("Song is already playing.")
+                    return
+                elif player.paused:
+                    await player.set_pause(False)
+                    now_playing_panels.update(interaction.guild.id)
+                    await interaction.followup.send("Song resumed.")
+                    return
+                else:
+                    await interaction.followup.send("No song is playing.")
+                    return
             
-        player = await ensure_voice(interaction, user_should_connect=True, bot_should_connect=False)
-
-        # --- Play Logic ---
-        if not interaction.guild.voice_client:
-            await interaction.user.voice.channel.connect(cls=LavalinkClient, self_deaf=True)
-        # Search for the tracks using the provided query
-        result = await player.node.get_tracks(query)
-        match(result.load_type):
-            # The result is a playlist
-            case lavalink.LoadType.PLAYLIST:
-                tracks = result.tracks
-                for track in tracks:
+            player = await ensure_voice(interaction, user_should_connect=True, bot_should_connect=False)
+
+            # --- Play Logic ---
+            if not interaction.guild.voice_client:
+                await interaction.user.voice.channel.connect(cls=LavalinkClient, self_deaf=True)
+
+            # --- Progressive Playlist Logic ---
+            # Start on the selected song while the rest of an uncached playlist loads in the background
+            first_url = first_track_url(query)
+            if first_url and query not in track_cache:
+                result = await get_tracks(player, first_url)
+                if result.load_type == lavalink.LoadType.TRACK:
+                    track = result.tracks[0]
                     player.add(requester=interaction.user.id, track=track)
-                await interaction.followup.send(f"Added {len(tracks)} songs from **`{result.playlist_info.name}`** to the queue.")
-            # The result is a song
-            case lavalink.LoadType.TRACK:
-                track = result.tracks[0]
-                player.add(requester=interaction.user.id, track=track)
-                await interaction.followup.send(f"Added `{track.title}` to the queue.")
-            # Empty/Error result
-            case _:
-                await interaction.followup.send("No results found.")
-                return
-
-        # If nothing is playing, start playback
-        if not player.is_playing:
-            await player.play()
+                    if not player.is_playing:
+                        await player.play()
+                    message = await interaction.followup.send(f"Added `{track.title}` to the queue, loading the rest of the playlist...", wait=True)
+                    load = PlaylistLoad(player, query, interaction.user.id, track, message)
+                    player.load_playlist(load, lambda q: get_tracks(player, q))
+                    return
+
+            # Search for the tracks using the provided query
+            result = await get_tracks(player, query)
+            match(result.load_type):
+                # The result is a playlist
+                case lavalink.LoadType.PLAYLIST:
+                    tracks = result.tracks
+                    player.add_many(tracks, requester=interaction.user.id)
+                    await interaction.followup.send(f"Added {len(tracks)} songs from **`{result.playlist_info.name}`** to the queue.")
+                # The result is a song
+                case lavalink.LoadType.TRACK:
+                    track = result.tracks[0]
+                    player.add(requester=interaction.user.id, track=track)
+                    await interaction.followup.send(f"Added `{track.title}` to the queue.")
+                # Empty/Error result
+                case _:
+                    await interaction.followup.send("No results found.")
+                    return
+
+            # If nothing is playing, start playback
+            if not player.is_playing:
+                await player.play()
     
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in play command: {e}")
-        await interaction.followup.send("An error occurred while trying to play the track.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Overloaded:
+            await interaction.followup.send(OVERLOADED_MESSAGE)
+        except Exception as e:
+            log.error(f"Error in play command: {e}")
+            await interaction.followup.send("An error occurred while trying to play the track.")
 
 
 @bot.tree.command(name="pause", description="Pause the song")
+@metrics.timed
 async def pause(interaction: Interaction):
-    await interaction.response.defer()
+    await defer(interaction)
 
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
-
-        if player.paused:
-            await interaction.followup.send("Song is already paused.")
-            return
-        elif not player.paused:
-            await player.set_pause(True)
-            await interaction.followup.send("Song paused.")
+    async with guild_commands.run(interaction.guild.id, key="pause") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
             return
-        else:
-            await interaction.followup.send("No song is playing.")
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in pause command: {e}")
-        await interaction.followup.send("An error occurred.")
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
+
+            if player.paused:
+                await interaction.followup.send("Song is already paused.")
+                return
+            elif not player.paused:
+                await player.set_pause(True)
+                now_playing_panels.update(interaction.guild.id)
+                await interaction.followup.send("Song paused.")
+                return
+            else:
+                await interaction.followup.send("No song is playing.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in pause command: {e}")
+            await interaction.followup.send("An error occurred.")
 
 @bot.tree.command(name="queue", description="Display the queue")
-async def queue(interaction: Interaction):
-    await interaction.response.defer()
+@app_commands.describe(page="Page of the queue to show")
+@metrics.timed
+async def queue(interaction: Interaction, page: int=1):
+    await defer(interaction)
     try:
         player = await ensure_voice(interaction, user_should_connect=True)
 
@@ -247,144 +752,242 @@ async def queue(interaction: Interaction):
             await interaction.followup.send("The queue is empty.")
             return
         else:
-            queue_list = ""
-            for i, track in enumerate(player.queue[:10]):
-                duration = lavalink.utils.format_time(track.duration)
-                if duration.startswith("00:"):
-                    duration = duration[3:]
-                queue_list += f"{i+1}. [{track.title}]({track.uri}) - `{duration}`\n"
-            embed = discord.Embed(title="Queue", color=0x22a7f2)
-            embed.add_field(name="", value=queue_list, inline=False)
-            await interaction.followup.send(embed=embed)
+            # Pages are rendered on demand and cached until the queue changes
+            view = QueueView(player.queue_pages, page)
+            await interaction.followup.send(embed=await player.queue_pages.embed(view.page), view=view)
     except app_commands.AppCommandError as e:
         await interaction.followup.send(str(e))
     except Exception as e:
-        print(f"Error in queue command: {e}")
+        log.error(f"Error in queue command: {e}")
         await interaction.followup.send("An error occurred while trying to display the queue.")
 
 @bot.tree.command(name="insert", description="Insert song or playlist to the front of the queue")
 @app_commands.describe(query="URL or search query")
+@metrics.timed
 async def insert(interaction: Interaction, query: str):
-    await interaction.response.defer()
+    await defer(interaction)
 
+    async with guild_commands.run(interaction.guild.id):
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
+
+            # Search for the tracks using the provided query
+            result = await get_tracks(player, query)
+            match(result.load_type):
+                # The result is a playlist
+                case lavalink.LoadType.PLAYLIST:
+                    tracks = result.tracks
+                    # Insert the tracks at the front of the queue
+                    player.add_many(tracks, requester=interaction.user.id, index=0)
+                    await interaction.followup.send(f"Inserted {len(tracks)} songs from **`{result.playlist_info.name}`** to the front of the queue.")
+                # The result is a song
+                case lavalink.LoadType.TRACK:
+                    track = result.tracks[0]
+                    player.add(requester=interaction.user.id, track=track, index=0)
+                    await interaction.followup.send(f"Inserted `{track.title}` to the queue.")
+                # Empty/Error result
+                case _:
+                    await interaction.followup.send("No results found.")
+                    return
+
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Overloaded:
+            await interaction.followup.send(OVERLOADED_MESSAGE)
+        except Exception as e:
+            log.error(f"Error in insert command: {e}")
+            await interaction.followup.send("An error occurred while trying to insert the track.")
+
+@play.autocomplete("query")
+@insert.autocomplete("query")
+async def query_autocomplete(interaction: Interaction, current: str) -> list[app_commands.Choice[str]]:
+    start = time.perf_counter()
     try:
-        player = await ensure_voice(interaction, user_should_connect=True)
+        suggestions = await suggester.suggest(interaction.guild_id, interaction.user.id, current)
+    except Exception as e:
+        log.error(f"Error in query autocomplete: {e}")
+        suggestions = []
+    metrics.observe("autocomplete_seconds", time.perf_counter() - start)
+    # Values too long to fit a choice are searched by name instead
+    return [app_commands.Choice(name=name[:MAX_CHOICE_LENGTH], value=value if len(value) <= MAX_CHOICE_LENGTH else name[:MAX_CHOICE_LENGTH])
+            for name, value in suggestions]
+
+@bot.tree.command(name="history", description="Display the recently played songs")
+@app_commands.describe(page="Page of the history to show")
+@metrics.timed
+async def history(interaction: Interaction, page: int=1):
+    await defer(interaction)
 
-        # Search for the tracks using the provided query
-        result = await player.node.get_tracks(query)
-        match(result.load_type):
-            # The result is a playlist
-            case lavalink.LoadType.PLAYLIST:
-                tracks = result.tracks
-                # Insert the tracks at the front of the queue
-                for track in reversed(tracks):
-                    player.queue.insert(0, track)
-                await interaction.followup.send(f"Inserted {len(tracks)} songs from **`{result.playlist_info.name}`** to the front of the queue.")
-            # The result is a song
-            case lavalink.LoadType.TRACK:
-                track = result.tracks[0]
-                player.queue.insert(0, track)
-                await interaction.followup.send(f"Inserted `{track.title}` to the queue.")
-            # Empty/Error result
-            case _:
-                await interaction.followup.send("No results found.")
-                return
+    try:
+        entries = play_history.get(interaction.guild.id)
+        if not entries:
+            await interaction.followup.send("Nothing has been played yet.")
+            return
 
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
+        page_count = -(-len(entries) // PAGE_SIZE)
+        page = min(max(page, 1), page_count)
+        start = (page - 1) * PAGE_SIZE
+        shown = [entries[i] for i in range(start, min(start + PAGE_SIZE, len(entries)))]
+        tracks = await decode_many(search_node(interaction.guild.id), [(entry.encoded, entry.requester) for entry in shown])
+        lines = []
+        for i, (entry, track) in enumerate(zip(shown, tracks), start=start + 1):
+            duration = "LIVE" if entry.is_stream else format_duration(entry.duration)
+            title = f"[{track.title}]({track.uri})" if track else "Unknown track"
+            lines.append(f"{i}. {title} - `{duration}`")
+
+        embed = discord.Embed(title="History", color=0x22a7f2)
+        embed.add_field(name="", value="\n".join(lines), inline=False)
+        autoplay_state = "on" if play_history.autoplay(interaction.guild.id) else "off"
+        embed.set_footer(text=f"Page {page}/{page_count} | Use /replay to play a song again | Autoplay {autoplay_state}")
+        await interaction.followup.send(embed=embed)
     except Exception as e:
-        print(f"Error in insert command: {e}")
-        await interaction.followup.send("An error occurred while trying to insert the track.")
+        log.error(f"Error in history command: {e}")
+        await interaction.followup.send("An error occurred while trying to display the history.")
+
+@bot.tree.command(name="replay", description="Add a recently played song to the queue")
+@app_commands.describe(index="Index of the song in /history")
+@metrics.timed
+async def replay(interaction: Interaction, index: int=1):
+    await defer(interaction)
+
+    async with guild_commands.run(interaction.guild.id):
+        try:
+            entry = play_history.entry(interaction.guild.id, index)
+            if entry is None:
+                await interaction.followup.send("Invalid index.")
+                return
+
+            player = await ensure_voice(interaction, user_should_connect=True, bot_should_connect=False)
+            if not interaction.guild.voice_client:
+                await interaction.user.voice.channel.connect(cls=LavalinkClient, self_deaf=True)
+
+            # The history entry is already encoded, so it is queued without a new search
+            player.add(QueuedTrack(entry.encoded, entry.identifier, entry.duration, entry.is_stream, interaction.user.id))
+            track = (await player.decode([entry]))[0]
+            title = track.title if track else "Unknown track"
+            await interaction.followup.send(f"Added `{title}` to the queue.")
+
+            if not player.is_playing:
+                await player.play()
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in replay command: {e}")
+            await interaction.followup.send("An error occurred while trying to replay the track.")
+
+@bot.tree.command(name="autoplay", description="Keep playing related songs when the queue runs out")
+@app_commands.describe(enabled="Turn autoplay on or off")
+@metrics.timed
+async def autoplay(interaction: Interaction, enabled: bool):
+    await defer(interaction)
+
+    async with guild_commands.run(interaction.guild.id, key=f"autoplay:{enabled}") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
+            play_history.set_autoplay(interaction.guild.id, enabled)
+            player = bot.lavalink.player_manager.get(interaction.guild.id)
+            if not enabled:
+                autoplayer.discard(interaction.guild.id)
+            elif player is not None and player.is_playing:
+                # Start resolving related tracks now if the current one is the last
+                autoplayer.on_track_start(player)
+            await interaction.followup.send(f"Autoplay is now {'on' if enabled else 'off'}.")
+        except Exception as e:
+            log.error(f"Error in autoplay command: {e}")
+            await interaction.followup.send("An error occurred while trying to set autoplay.")
 
 @bot.tree.command(name="nowplaying", description="Display the current song")
-async def nowplaying(interaction: Interaction):
-    await interaction.response.defer()
+@app_commands.describe(live="Keep a message in this channel updated with the current song")
+@metrics.timed
+async def nowplaying(interaction: Interaction, live: bool=False):
+    await defer(interaction)
 
     try:
         player = await ensure_voice(interaction, user_should_connect=True)
 
+        if live:
+            # Replaces the guild's previous panel, it is kept updated until the player stops
+            await now_playing_panels.open(interaction.guild.id, interaction.channel)
+            await interaction.followup.send("Now playing panel created.")
+            return
+
         if not player.is_playing or player.current is None:
             await interaction.followup.send("No song is playing.")
             return
         else:
-            track = player.current
-            position = lavalink.utils.format_time(player.position)
-            duration = lavalink.utils.format_time(track.duration)
-            if position.startswith("00:"):
-                position = position[3:]
-            if duration.startswith("00:"):
-                duration = duration[3:]
-            embed = discord.Embed(title="Now Playing", color=0x22a7f2)
-            embed.add_field(name="", value=f"[{track.title}]({track.uri})", inline=False)
-            embed.add_field(name="", value=f"`{position}/{duration}`", inline=False)
-            embed.set_thumbnail(url=track.artwork_url)
-            user = bot.get_user(track.requester)
-            if user:
-                embed.set_footer(text=f"Requested by: {user.display_name}", icon_url=user.display_avatar.url)
+            embed = now_playing_embed(player, bot.get_user(player.current.requester))
             await interaction.followup.send(embed=embed)
     except app_commands.AppCommandError as e:
         await interaction.followup.send(str(e))
     except Exception as e:
-        print(f"Error in nowplaying command: {e}")
+        log.error(f"Error in nowplaying command: {e}")
         await interaction.followup.send("An error occurred while trying to display the current song.")
 
 @bot.tree.command(name="skip", description="Skip the song")
 @app_commands.describe(to="Skip to this index in queue")
+@metrics.timed
 async def skip(interaction: Interaction, to: int=1):
-    await interaction.response.defer()
+    await defer(interaction)
 
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
-        
-        if not player.is_playing:
-            await interaction.followup.send("No song is playing.")
+    async with guild_commands.run(interaction.guild.id, key=f"skip:{to}") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
             return
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
+        
+            if not player.is_playing:
+                await interaction.followup.send("No song is playing.")
+                return
 
-        if to < 1:
-            await interaction.followup.send("Please enter a valid number of songs to skip (1 or more).")
-            return
+            if to < 1:
+                await interaction.followup.send("Please enter a valid number of songs to skip (1 or more).")
+                return
 
-        if to == 1:
-            await interaction.followup.send(f"Skipping **`{player.current.title}`** that is currently playing.")
-            await player.skip()
-        else:
-            # Remove tracks from the front of the queue
-            for _ in range(to-1):
-                # Ensure queue is not empty before popping
-                if player.queue:
-                    player.queue.pop(0)
-                else:
-                    # Stop if queue becomes empty
-                    break
-            # Also skip the current track
-            await player.skip()
-            await interaction.followup.send(f"Skipped {to} songs.")
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in skip command: {e}")
-        await interaction.followup.send("An error occurred while trying to skip the song.")
+            if to == 1:
+                await interaction.followup.send(f"Skipping **`{player.current.title}`** that is currently playing.")
+                await player.skip()
+            else:
+                # Remove tracks from the front of the queue, stops early if the queue runs out
+                del player.queue[:to-1]
+                # Also skip the current track
+                await player.skip()
+                await interaction.followup.send(f"Skipped {to} songs.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in skip command: {e}")
+            await interaction.followup.send("An error occurred while trying to skip the song.")
 
 @bot.tree.command(name="shuffle", description="Toggle queue shuffle")
+@metrics.timed
 async def shuffle(interaction: Interaction):
-    await interaction.response.defer()
+    await defer(interaction)
 
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
+    async with guild_commands.run(interaction.guild.id, key="shuffle") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
         
-        # Toggle shuffle state
-        player.shuffle = not player.shuffle
+            # Toggle shuffle state
+            player.shuffle = not player.shuffle
+            # The next song changes, prefetch it again
+            prefetcher.invalidate(player)
 
-        if player.shuffle:
-            await interaction.followup.send("Queue shuffle enabled.")
-        else:
-            # Only stops randomizing future plays
-            await interaction.followup.send("Queue shuffle disabled.")
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in shuffle command: {e}")
-        await interaction.followup.send("An error occurred while trying to shuffle the queue.")
+            if player.shuffle:
+                await interaction.followup.send("Queue shuffle enabled.")
+            else:
+                # Only stops randomizing future plays
+                await interaction.followup.send("Queue shuffle disabled.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in shuffle command: {e}")
+            await interaction.followup.send("An error occurred while trying to shuffle the queue.")
 
 @bot.tree.command(name="loop", description="Toggle loop mode")
 @app_commands.describe(option="Loop the current song or the entire queue")
@@ -392,121 +995,317 @@ async def shuffle(interaction: Interaction):
     app_commands.Choice(name="Loop song", value="song"),
     app_commands.Choice(name="Loop queue", value="queue")
 ])
+@metrics.timed
 async def loop(interaction: Interaction, option: str="normal"):
-    await interaction.response.defer()
-
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
-
-        match option:
-            case "normal":
-                if player.loop == 0:
-                    await interaction.followup.send("Please specify an loop option.")
-                else:
-                    player.loop = 0
-                    await interaction.followup.send("Loop mode disabled.")
-            case "song":
-                player.loop = 1
-                await interaction.followup.send(f"Song loop enabled.")
-            case "queue":
-                player.loop = 2
-                await interaction.followup.send(f"Queue loop enabled.")
+    await defer(interaction)
 
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in loop command: {e}")
-        await interaction.followup.send("An error occurred while trying to set loop mode.")
+    async with guild_commands.run(interaction.guild.id, key=f"loop:{option}") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
 
-@bot.tree.command(name="remove", description="Remove song from queue")
-async def remove(interaction: Interaction, index: int):
-    await interaction.response.defer()
+            match option:
+                case "normal":
+                    if player.loop == 0:
+                        await interaction.followup.send("Please specify an loop option.")
+                    else:
+                        player.loop = 0
+                        await interaction.followup.send("Loop mode disabled.")
+                case "song":
+                    player.loop = 1
+                    await interaction.followup.send(f"Song loop enabled.")
+                case "queue":
+                    player.loop = 2
+                    await interaction.followup.send(f"Queue loop enabled.")
+            # What plays next may have changed
+            prefetcher.invalidate(player)
+
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in loop command: {e}")
+            await interaction.followup.send("An error occurred while trying to set loop mode.")
+
+@bot.tree.command(name="remove", description="Remove a song or a range of songs from the queue")
+@app_commands.describe(index="Index of the song, or a range of indexes like 5-200")
+@metrics.timed
+async def remove(interaction: Interaction, index: str):
+    await defer(interaction)
+
+    async with guild_commands.run(interaction.guild.id, key=f"remove:{index}") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
 
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
+            if not player.queue:
+                await interaction.followup.send("Queue is empty.")
+                return
+            span = parse_range(index, len(player.queue))
+            if span is None:
+                await interaction.followup.send("Invalid index.")
+                return
+            start, stop = span
+            if stop - start == 1:
+                removed_track = (await player.decode([player.queue.pop(start)]))[0]
+                title = removed_track.title if removed_track else "Unknown track"
+                await interaction.followup.send(f"Removed **`{title}`** (at index {start + 1}) from the queue.")
+            else:
+                removed = player.queue.remove_range(start, stop)
+                await interaction.followup.send(f"Removed {removed} songs (at indexes {start + 1}-{stop}) from the queue.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in remove command: {e}")
+            await interaction.followup.send("An error occurred while trying to remove the track.")
+
+@bot.tree.command(name="removeuser", description="Remove every song a member added to the queue")
+@app_commands.describe(member="Member whose songs to remove")
+@metrics.timed
+async def removeuser(interaction: Interaction, member: discord.Member):
+    await defer(interaction)
+
+    async with guild_commands.run(interaction.guild.id, key=f"removeuser:{member.id}") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
 
-        if not player.queue:
-            await interaction.followup.send("Queue is empty.")
+            removed = player.remove_requester(member.id)
+            if not removed:
+                await interaction.followup.send(f"No songs from {member.display_name} in the queue.")
+                return
+            await interaction.followup.send(f"Removed {len(removed)} songs from {member.display_name} from the queue.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in removeuser command: {e}")
+            await interaction.followup.send("An error occurred while trying to remove the tracks.")
+
+@bot.tree.command(name="dedupe", description="Remove duplicate songs from the queue")
+@metrics.timed
+async def dedupe(interaction: Interaction):
+    await defer(interaction)
+
+    async with guild_commands.run(interaction.guild.id, key="dedupe") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
             return
-        if index < 1 or index > len(player.queue):
-            await interaction.followup.send("Invalid index.")
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
+
+            removed = player.remove_duplicates()
+            if not removed:
+                await interaction.followup.send("No duplicate songs in the queue.")
+                return
+            await interaction.followup.send(f"Removed {len(removed)} duplicate songs from the queue.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in dedupe command: {e}")
+            await interaction.followup.send("An error occurred while trying to remove duplicates.")
+
+@bot.tree.command(name="move", description="Move a song to another position in the queue")
+@app_commands.describe(index="Index of the song to move", to="Index to move the song to")
+@metrics.timed
+async def move(interaction: Interaction, index: int, to: int=1):
+    await defer(interaction)
+
+    async with guild_commands.run(interaction.guild.id, key=f"move:{index}:{to}") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
             return
-        else:
-            removed_track = player.queue.pop(index-1)
-            await interaction.followup.send(f"Removed **`{removed_track.title}`** (at index {index}) from the queue.")
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in remove command: {e}")
-        await interaction.followup.send("An error occurred while trying to remove the track.")
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
+
+            if not player.queue:
+                await interaction.followup.send("Queue is empty.")
+                return
+            if not 1 <= index <= len(player.queue) or not 1 <= to <= len(player.queue):
+                await interaction.followup.send("Invalid index.")
+                return
+            moved_track = (await player.decode([player.queue.move(index-1, to-1)]))[0]
+            title = moved_track.title if moved_track else "Unknown track"
+            await interaction.followup.send(f"Moved **`{title}`** from index {index} to {to}.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in move command: {e}")
+            await interaction.followup.send("An error occurred while trying to move the track.")
 
 @bot.tree.command(name="clear", description="Clear the queue")
+@metrics.timed
 async def clear(interaction: Interaction):
-    await interaction.response.defer()
+    await defer(interaction)
 
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
-        
-        if not player.queue:
-            await interaction.followup.send("The queue is already empty.")
+    async with guild_commands.run(interaction.guild.id, key="clear") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
             return
-        else:
-            player.queue.clear()
-            await interaction.followup.send("Queue cleared.")
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in clear command: {e}")
-        await interaction.followup.send("An error occurred while trying to clear the queue.")
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
+        
+            loading = player.cancel_playlist_load()
+            if not player.queue and not loading:
+                await interaction.followup.send("The queue is already empty.")
+                return
+            else:
+                player.queue.clear()
+                await interaction.followup.send("Queue cleared.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in clear command: {e}")
+            await interaction.followup.send("An error occurred while trying to clear the queue.")
 
 @bot.tree.command(name="stop", description="Terminate the player")
+@metrics.timed
 async def stop(interaction: Interaction):
-    await interaction.response.defer()
+    await defer(interaction)
 
-    try:
-        player = await ensure_voice(interaction, user_should_connect=True)
+    async with guild_commands.run(interaction.guild.id, key="stop") as coalesced:
+        if coalesced:
+            await interaction.followup.send(COALESCED_MESSAGE)
+            return
+        try:
+            player = await ensure_voice(interaction, user_should_connect=True)
 
-        player.queue.clear()
-        await player.stop()
-        if interaction.guild.voice_client:
-                await interaction.guild.voice_client.disconnect(force=True)
-        await interaction.followup.send("Player Terminated.")
+            player.cancel_playlist_load()
+            player.queue.clear()
+            await player.stop()
+            if interaction.guild.voice_client:
+                    await interaction.guild.voice_client.disconnect(force=True)
+            await interaction.followup.send("Player Terminated.")
         
-    except app_commands.AppCommandError as e:
-        await interaction.followup.send(str(e))
-    except Exception as e:
-        print(f"Error in stop command: {e}")
-        await interaction.followup.send("An error occurred while trying to stop the player.")
+        except app_commands.AppCommandError as e:
+            await interaction.followup.send(str(e))
+        except Exception as e:
+            log.error(f"Error in stop command: {e}")
+            await interaction.followup.send("An error occurred while trying to stop the player.")
 
 @bot.tree.command(name="playlist", description="Display updated playlist")
-async def playlist(interaction: Interaction, url: str, added: int=None):
+@metrics.timed
+async def playlist(interaction: Interaction, url: str):
     channel = interaction.channel
-    await interaction.response.defer(ephemeral=True)
+    await defer(interaction, ephemeral=True)
     player = await ensure_voice(interaction, user_should_connect=False)
 
     try:
-        # Search for the tracks using the provided query
-        result = await player.node.get_tracks(url)
+        # Always fetch the latest playlist contents, this also refreshes the cache for /play
+        track_cache.invalidate(url)
+        result = await get_tracks(player, url)
         if result.load_type == lavalink.LoadType.PLAYLIST:
-            # delete old playlist message
-            async for message in channel.history(limit=25):
-                if message.embeds:
-                    for embed in message.embeds:
-                        if embed.url == url:
-                            await message.delete()
+            # Diff against the tracks of the last announcement of this playlist in this channel
+            key = normalize_query(url)
+            previous = await state_store.get_announcement(interaction.guild.id, channel.id, key)
+            identifiers = [track.identifier for track in result.tracks]
+            if previous:
+                known = set(previous[1])
+                added = [track for track in result.tracks if track.identifier not in known]
+                removed = len(known - set(identifiers))
+            else:
+                added, removed = [], 0
 
             embed = discord.Embed(title=f"{result.playlist_info.name}", url=url, color=0x22a7f2)
             embed.set_thumbnail(url=result.tracks[0].artwork_url)
             if added:
-                embed.add_field(name="New", value=f"`{added}`", inline=True)
+                embed.add_field(name="New", value=f"`{len(added)}`", inline=True)
             embed.add_field(name="Command", value=f"`/play query:{url}`", inline=True)
-            await channel.send(embed=embed)
-            await interaction.followup.send(f"Playlist updated.")
+
+            # Replace the old announcement: edit it in place if it's still the latest message, otherwise repost
+            message = None
+            if previous:
+                old_message = channel.get_partial_message(previous[0])
+                try:
+                    if channel.last_message_id == previous[0]:
+                        message = await old_message.edit(embed=embed)
+                    else:
+                        await old_message.delete()
+                except discord.NotFound:
+                    pass
+            else:
+                # Announced before the index existed, look for it in recent messages this one time
+                async for old_message in channel.history(limit=25):
+                    if any(old_embed.url == url for old_embed in old_message.embeds):
+                        await old_message.delete()
+            if message is None:
+                message = await channel.send(embed=embed)
+            await state_store.set_announcement(interaction.guild.id, channel.id, key, message.id, identifiers)
+
+            if not previous:
+                await interaction.followup.send(f"Playlist announced with {len(identifiers)} songs.")
+            elif not added and not removed:
+                await interaction.followup.send("Playlist updated, no changes since the last announcement.")
+            else:
+                new_list = "\n".join(f"- {track.title}" for track in added[:10])
+                if len(added) > 10:
+                    new_list += f"\n- and {len(added) - 10} more"
+                await interaction.followup.send(f"Playlist updated, {len(added)} new and {removed} removed songs.\n{new_list}")
         else:
             await interaction.followup.send(f"Please provide a valid playlist URL.")
 
+    except Overloaded:
+        await interaction.followup.send(OVERLOADED_MESSAGE)
     except Exception as e:
-        print(f"Error in playlist command: {e}")
+        log.error(f"Error in playlist command: {e}")
         await interaction.followup.send("An error occurred while trying to update the playlist.")
 
-bot.run(BOT_TOKEN)
\ No newline at end of file
+# Process level stats, reported to launcher.py when running as a worker
+def worker_stats() -> dict:
+    players = bot.lavalink.player_manager.players.values() if hasattr(bot, 'lavalink') else []
+    return {
+        "worker": WORKER_ID,
+        "shards": sorted(bot.shards) if SHARDED else [0],
+        "guilds": len(bot.guilds),
+        "players": len(players),
+        "playing": sum(1 for player in players if player.is_playing),
+        "queued": sum(len(player.queue) for player in players),
+        "latency": bot.latency,
+        "cache": track_cache.stats,
+    }
+
+async def report_loop(report_queue, interval: float = 15):
+    await bot.wait_until_ready()
+    while not bot.is_closed():
+        try:
+            report_queue.put_nowait(worker_stats())
+        except Exception as e:
+            log.error(f"Error while reporting worker stats: {e}")
+        await asyncio.sleep(interval)
+
+# Gauges read at scrape time
+def _players():
+    return bot.lavalink.player_manager.players.values() if hasattr(bot, 'lavalink') else []
+
+metrics.gauge("active_players", "Players connected to a voice channel", lambda: sum(1 for player in _players() if player.is_connected))
+metrics.gauge("playing_players", "Players currently playing a track", lambda: sum(1 for player in _players() if player.is_playing))
+metrics.gauge("queued_tracks", "Tracks queued across all players", lambda: sum(len(player.queue) for player in _players()))
+metrics.gauge("guilds", "Guilds served by this process", lambda: len(bot.guilds))
+metrics.gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: metrics.last_loop_lag)
+metrics.gauge("idle_timers", "Guilds with a pending idle check", lambda: len(idle_reaper))
+metrics.gauge("now_playing_panels", "Live now playing panels", lambda: len(now_playing_panels))
+metrics.gauge("pending_message_edits", "Message edits waiting in the edit scheduler", lambda: len(edit_scheduler))
+metrics.gauge("guilds_with_pending_commands", "Guilds with player commands queued or running", lambda: len(guild_commands))
+metrics.gauge("lavalink_lookups_in_flight", "Track lookups sent to Lavalink and not yet answered", lambda: lookup_admission.in_flight)
+metrics.gauge("lavalink_lookups_waiting", "Track lookups waiting for admission", lambda: lookup_admission.waiting)
+metrics.gauge("autoplay_resolving", "Guilds resolving autoplay candidates", lambda: len(autoplayer))
+metrics.gauge("history_tracks", "Tracks remembered in play histories", lambda: len(play_history))
+metrics.gauge("prefetches_running", "Upcoming track checks in progress", lambda: len(prefetcher))
+metrics.gauge("track_cache_entries", "Entries in the track cache", lambda: len(track_cache))
+metrics.counter("track_cache_hits_total", "Track lookups answered from the cache", lambda: track_cache.hits)
+metrics.counter("track_cache_misses_total", "Track lookups sent to Lavalink", lambda: track_cache.misses)
+metrics.counter("track_cache_coalesced_total", "Track lookups that joined one already in flight", lambda: track_cache.coalesced)
+metrics.counter("track_cache_evictions_total", "Track cache entries evicted or expired", lambda: track_cache.evictions)
+
+def main(report_queue=None):
+    setup_logging()
+    bot.report_queue = report_queue
+    # Logging is already routed through the log queue
+    bot.run(BOT_TOKEN, log_handler=None)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,52 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from metrics import metrics
+
+
+class GuildExecutor:
+    """
+    Orders the commands that change a guild's player.
+
+    Commands of the same guild run one at a time, in the order they arrived.
+    A command given a ``key`` while an identical one is already queued or
+    running is coalesced: it waits for that one to finish instead of repeating
+    it, e.g. two users pressing /skip at the same time skip one song, not two.
+    """
+
+    def __init__(self):
+        # guild_id -> [lock, number of commands holding or waiting for it]
+        self._locks: dict[int, list] = {}
+        self._inflight: dict[tuple[int, str], asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        """ Number of guilds with commands queued or running. """
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def run(self, guild_id: int, key: str | None = None) -> AsyncIterator[bool]:
+        """ Run the body exclusively for the guild, yields True if it was coalesced and must not act. """
+        if key is not None:
+            future = self._inflight.get((guild_id, key))
+            if future is not None:
+                metrics.inc("coalesced_commands_total", command=key.partition(":")[0])
+                await asyncio.shield(future)
+                yield True
+                return
+            future = self._inflight[(guild_id, key)] = asyncio.get_running_loop().create_future()
+
+        entry = self._locks.get(guild_id)
+        if entry is None:
+            entry = self._locks[guild_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield False
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[guild_id]
+            if key is not None:
+                del self._inflight[(guild_id, key)]
+                future.set_result(None)
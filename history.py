@@ -0,0 +1,87 @@
+from collections import deque
+
+import lavalink
+
+from queued_track import QueuedTrack
+
+# Tracks that ended this way were actually heard, failed loads and cleanups are not history
+RECORDED_REASONS = (lavalink.EndReason.FINISHED, lavalink.EndReason.STOPPED, lavalink.EndReason.REPLACED)
+
+
+class PlayHistory:
+    """
+    Recently played tracks of every guild, newest first.
+
+    Each guild keeps a bounded ring buffer of compact QueuedTrack entries, so
+    replaying one needs no search. Guilds whose history or autoplay setting
+    changed are marked dirty and only those are written by the next snapshot.
+    """
+
+    def __init__(self, size: int = 50):
+        self.size = size
+        self._tracks: dict[int, deque[QueuedTrack]] = {}
+        self._autoplay: set[int] = set()
+        self._dirty: set[int] = set()
+
+    def __len__(self) -> int:
+        return sum(len(tracks) for tracks in self._tracks.values())
+
+    def get(self, guild_id: int) -> deque[QueuedTrack]:
+        return self._tracks.get(guild_id, deque())
+
+    def entry(self, guild_id: int, index: int) -> QueuedTrack | None:
+        """ The 1-indexed entry of a guild's history, 1 being the last track played. """
+        tracks = self._tracks.get(guild_id)
+        if not tracks or not 1 <= index <= len(tracks):
+            return None
+        return tracks[index - 1]
+
+    def record(self, guild_id: int, track: lavalink.AudioTrack):
+        tracks = self._tracks.get(guild_id)
+        if tracks is None:
+            tracks = self._tracks[guild_id] = deque(maxlen=self.size)
+        # A looping track is only recorded once
+        if tracks and tracks[0].encoded == track.track:
+            return
+        tracks.appendleft(QueuedTrack.from_track(track))
+        self._dirty.add(guild_id)
+
+    def recent_identifiers(self, guild_id: int) -> set[str]:
+        return {entry.identifier for entry in self._tracks.get(guild_id, ())}
+
+    def autoplay(self, guild_id: int) -> bool:
+        return guild_id in self._autoplay
+
+    def set_autoplay(self, guild_id: int, enabled: bool):
+        if enabled:
+            self._autoplay.add(guild_id)
+        else:
+            self._autoplay.discard(guild_id)
+        self._dirty.add(guild_id)
+
+    def dirty_rows(self) -> list[tuple[int, list[tuple[str, int]], bool]]:
+        """ Take the (guild id, (encoded track, requester) pairs, autoplay) rows changed since the last call. """
+        rows = [(guild_id, [(entry.encoded, entry.requester) for entry in self._tracks.get(guild_id, ())],
+                 guild_id in self._autoplay) for guild_id in self._dirty]
+        self._dirty.clear()
+        return rows
+
+    def mark_dirty(self, guild_ids):
+        """ Have the next snapshot write these guilds again, e.g. after a failed write. """
+        self._dirty.update(guild_ids)
+
+    def restore(self, rows: list[tuple[int, list[tuple[str, int]], bool]]):
+        """
+        Load rows saved by a previous run. Each entry is decoded locally once for the few
+        fields a QueuedTrack keeps, entries the local decoder can't read are dropped.
+        """
+        for guild_id, entries, autoplay in rows:
+            tracks = self._tracks[guild_id] = deque(maxlen=self.size)
+            for encoded, requester in entries[:self.size]:
+                try:
+                    info = lavalink.decode_track(encoded).raw["info"]
+                except Exception:
+                    continue
+                tracks.append(QueuedTrack(encoded, info["identifier"], info["length"], info["isStream"], requester))
+            if autoplay:
+                self._autoplay.add(guild_id)
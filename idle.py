@@ -0,0 +1,80 @@
+import asyncio
+import logging
+
+import discord
+
+from metrics import metrics
+from timer_wheel import TimerWheel
+
+log = logging.getLogger(__name__)
+
+
+def idle_reason(channel, player) -> str | None:
+    """ Return why a voice connection is idle, or None if it is in use. """
+    if not any(not member.bot for member in channel.members):
+        return "alone"
+    if player is None or not player.is_playing or player.paused:
+        return "idle"
+    return None
+
+
+class IdleReaper:
+    """
+    Disconnects players that stopped playing or were left alone in their channel.
+
+    Every guild has at most one pending check on a shared timer wheel. Activity
+    pushes the check back by ``idle_timeout``, and being left alone pulls it
+    forward to ``alone_timeout``. When a check fires the guild is re-examined
+    and only disconnected if it is still idle, so stale checks are harmless.
+    """
+
+    def __init__(self, bot: discord.Client, idle_timeout: float, alone_timeout: float, wheel: TimerWheel | None = None):
+        self.bot = bot
+        self.idle_timeout = idle_timeout
+        self.alone_timeout = alone_timeout
+        self.wheel = wheel or TimerWheel()
+
+    def __len__(self) -> int:
+        return len(self.wheel)
+
+    def start(self):
+        self.wheel.start()
+
+    def touch(self, guild_id: int):
+        """ Record activity, the guild is checked again after the idle timeout. """
+        self.wheel.schedule(guild_id, self.idle_timeout, self._expire)
+
+    def alone(self, guild_id: int):
+        """ The bot was left alone, check sooner unless a check is already due. """
+        remaining = self.wheel.remaining(guild_id)
+        if remaining is None or remaining > self.alone_timeout:
+            self.wheel.schedule(guild_id, self.alone_timeout, self._expire)
+
+    def cancel(self, guild_id: int):
+        self.wheel.cancel(guild_id)
+
+    def _expire(self, guild_id: int):
+        asyncio.create_task(self.reap(guild_id))
+
+    async def reap(self, guild_id: int) -> bool:
+        """ Disconnect the guild's player if it is idle. """
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild else None
+        if voice_client is None:
+            return False
+
+        player = self.bot.lavalink.player_manager.get(guild_id)
+        reason = idle_reason(voice_client.channel, player)
+        if reason is None:
+            return False
+
+        log.info(f"Disconnecting {reason} player in guild {guild_id}")
+        metrics.inc("idle_disconnects_total", reason=reason)
+        try:
+            if player is not None:
+                player.cancel_playlist_load()
+            await voice_client.disconnect(force=True)
+        except Exception as e:
+            log.error(f"Error while disconnecting idle player {guild_id}: {e}")
+            return False
+        return True
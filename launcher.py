@@ -0,0 +1,157 @@
+"""
+Runs the bot as several worker processes, each owning a contiguous range of shards.
+
+    python launcher.py
+
+SHARD_COUNT defaults to Discord's recommended shard count and WORKERS to the
+number of CPU cores. Each worker runs its own event loop and Lavalink client,
+and periodically reports its stats back here to be aggregated.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import time
+from dotenv import load_dotenv, find_dotenv
+import aiohttp
+from sharding import shard_ranges
+from log_queue import setup_logging
+
+load_dotenv(find_dotenv())
+load_dotenv(".env.dev", override=True)
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+SHARD_COUNT = os.getenv("SHARD_COUNT")
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))
+# Discord allows one IDENTIFY per 5 seconds, stagger workers so they don't collide
+WORKER_START_DELAY = float(os.getenv("WORKER_START_DELAY", 5))
+REPORT_INTERVAL = float(os.getenv("REPORT_INTERVAL", 60))
+# Consecutive crashes after which a worker is left down, and the most seconds to wait between restarts
+WORKER_MAX_RESTARTS = int(os.getenv("WORKER_MAX_RESTARTS", 5))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 300))
+# A worker that stayed up this long is considered healthy again
+WORKER_STABLE_TIME = 600
+
+log = logging.getLogger("fcmusic.launcher")
+
+def run_worker(worker_id: int, shard_ids: list[int], shard_count: int, report_queue):
+    """ Entry point of a worker process. """
+    os.environ["WORKER_ID"] = str(worker_id)
+    os.environ["SHARD_IDS"] = ",".join(map(str, shard_ids))
+    os.environ["SHARD_COUNT"] = str(shard_count)
+    # Imported here so the environment above is in place when bot.py reads it
+    import bot
+    bot.main(report_queue)
+
+async def recommended_shards(token: str) -> int:
+    """ Ask Discord how many shards the bot should run. """
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+            return data["shards"]
+
+def aggregate(stats: dict[int, dict]) -> dict:
+    """ Combine the latest stats of every worker into process-wide totals. """
+    total = {"workers": len(stats), "shards": 0, "guilds": 0, "players": 0, "playing": 0, "queued": 0,
+             "max_latency": 0.0, "cache_hits": 0, "cache_misses": 0}
+    for worker in stats.values():
+        total["shards"] += len(worker["shards"])
+        for key in ("guilds", "players", "playing", "queued"):
+            total[key] += worker[key]
+        total["max_latency"] = max(total["max_latency"], worker["latency"])
+        total["cache_hits"] += worker["cache"]["hits"]
+        total["cache_misses"] += worker["cache"]["misses"]
+    return total
+
+class Launcher:
+    def __init__(self, shard_count: int, workers: int):
+        self.shard_count = shard_count
+        self.ranges = shard_ranges(shard_count, workers)
+        self.context = multiprocessing.get_context("spawn")
+        self.report_queue = self.context.Queue()
+        self.processes: dict[int, multiprocessing.Process] = {}
+        self.stats: dict[int, dict] = {}
+        self.started: dict[int, float] = {}
+        self.failures: dict[int, int] = {}
+        # worker id -> time at which a crashed worker is restarted
+        self.restart_at: dict[int, float] = {}
+
+    def start_worker(self, worker_id: int):
+        shard_ids = self.ranges[worker_id]
+        process = self.context.Process(target=run_worker, name=f"worker-{worker_id}",
+                                       args=(worker_id, shard_ids, self.shard_count, self.report_queue))
+        process.start()
+        self.processes[worker_id] = process
+        self.started[worker_id] = time.monotonic()
+        log.info(f"Started worker {worker_id} (pid {process.pid}) with shards {shard_ids[0]}-{shard_ids[-1]}")
+
+    def run(self):
+        log.info(f"Launching {len(self.ranges)} workers for {self.shard_count} shards")
+        for worker_id in range(len(self.ranges)):
+            self.start_worker(worker_id)
+            time.sleep(WORKER_START_DELAY)
+
+        last_report = time.monotonic()
+        try:
+            while True:
+                try:
+                    stats = self.report_queue.get(timeout=1)
+                    self.stats[stats["worker"]] = stats
+                except queue.Empty:
+                    pass
+
+                # Restart workers that crashed, backing off while they keep crashing
+                for worker_id, process in list(self.processes.items()):
+                    if not process.is_alive():
+                        self.worker_exited(worker_id, process)
+                for worker_id, restart_at in list(self.restart_at.items()):
+                    if time.monotonic() >= restart_at:
+                        del self.restart_at[worker_id]
+                        self.start_worker(worker_id)
+                if not self.processes and not self.restart_at:
+                    log.error("Every worker gave up, exiting")
+                    break
+
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    log.info(f"Stats: {aggregate(self.stats)}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def worker_exited(self, worker_id: int, process: multiprocessing.Process):
+        del self.processes[worker_id]
+        self.stats.pop(worker_id, None)
+        if time.monotonic() - self.started[worker_id] >= WORKER_STABLE_TIME:
+            self.failures[worker_id] = 0
+        failures = self.failures[worker_id] = self.failures.get(worker_id, 0) + 1
+        if failures > WORKER_MAX_RESTARTS:
+            log.error(f"Worker {worker_id} exited with code {process.exitcode} after {failures - 1} restarts, "
+                      f"giving up on shards {self.ranges[worker_id][0]}-{self.ranges[worker_id][-1]}")
+            return
+        # Jittered, but never shorter than half the backoff so a crash loop can't restart right away
+        delay = min(WORKER_RESTART_DELAY, WORKER_START_DELAY * 2 ** failures)
+        delay = random.uniform(delay / 2, delay)
+        log.warning(f"Worker {worker_id} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+        self.restart_at[worker_id] = time.monotonic() + delay
+
+    def stop(self):
+        # SIGTERM lets each worker close cleanly and take a final snapshot, see MusicBot.setup_hook
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                log.warning(f"Worker {process.name} didn't stop in time, killing it")
+                process.kill()
+
+def main():
+    setup_logging()
+    shard_count = int(SHARD_COUNT) if SHARD_COUNT else asyncio.run(recommended_shards(BOT_TOKEN))
+    Launcher(shard_count, WORKERS).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import functools
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import aiohttp
+from aiohttp import web
+
+# Latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Name of the command the current task is running, used to attribute segments
+_command: contextvars.ContextVar[str | None] = contextvars.ContextVar("command", default=None)
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """ Estimate a quantile from the bucket counts. """
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """ Minimal in-process metrics registry rendered in the Prometheus text format. """
+
+    def __init__(self):
+        self._help: dict[str, tuple[str, str]] = {}
+        self._histograms: dict[str, dict[tuple, Histogram]] = defaultdict(dict)
+        self._counters: dict[str, dict[tuple, float]] = defaultdict(lambda: defaultdict(float))
+        # Gauges and counters whose value is read at scrape time
+        self._callbacks: dict[str, callable] = {}
+        self._values: dict[str, dict[tuple, float]] = defaultdict(dict)
+        self.last_loop_lag = 0.0
+
+    def describe(self, name: str, kind: str, help: str):
+        self._help[name] = (kind, help)
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        histogram = self._histograms[name].get(key)
+        if histogram is None:
+            histogram = self._histograms[name][key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        self._counters[name][tuple(sorted(labels.items()))] += amount
+
+    def gauge(self, name: str, help: str, func):
+        """ Register a gauge whose value is read from ``func`` at scrape time. """
+        self.describe(name, "gauge", help)
+        self._callbacks[name] = func
+
+    def counter(self, name: str, help: str, func):
+        """ Register a counter kept elsewhere, its value is read from ``func`` at scrape time. """
+        self.describe(name, "counter", help)
+        self._callbacks[name] = func
+
+    def set(self, name: str, value: float, **labels):
+        """ Set a gauge to a fixed value. """
+        self._values[name][tuple(sorted(labels.items()))] = value
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self._histograms[name].get(tuple(sorted(labels.items())))
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self._histograms.items():
+            self._header(lines, name, "histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for name, series in self._counters.items():
+            self._header(lines, name, "counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_labels(labels)} {value}")
+        for name, series in self._values.items():
+            self._header(lines, name, "gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{_labels(labels)} {value}")
+        for name, func in self._callbacks.items():
+            self._header(lines, name, "gauge")
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines: list, name: str, kind: str):
+        kind, help = self._help.get(name, (kind, ""))
+        if help:
+            lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def timed(self, func):
+        """ Decorator recording the total latency of an app command callback. """
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = _command.set(func.__name__)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.observe("command_seconds", time.perf_counter() - start, command=func.__name__)
+                _command.reset(token)
+        return wrapper
+
+    def timed_segment(self, name: str):
+        """ Decorator timing a coroutine function as a segment of the running command. """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.segment(name):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def segment(self, name: str):
+        """ Time a segment of the command currently running in this task, if any. """
+        command = _command.get()
+        if command is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("command_segment_seconds", time.perf_counter() - start, command=command, segment=name)
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """ aiohttp tracing hooks recording Lavalink REST latency and errors. """
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.start = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            endpoint = lavalink_endpoint(params.url.path)
+            self.observe("lavalink_request_seconds", time.perf_counter() - context.start, endpoint=endpoint)
+            if params.response.status >= 400:
+                self.inc("lavalink_request_errors_total", endpoint=endpoint)
+
+        async def on_request_exception(session, context, params):
+            endpoint = lavalink_endpoint(params.url.path)
+            self.observe("lavalink_request_seconds", time.perf_counter() - context.start, endpoint=endpoint)
+            self.inc("lavalink_request_errors_total", endpoint=endpoint)
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    async def monitor_loop_lag(self, interval: float = 0.5):
+        """ Measure how late the event loop wakes up from a sleep. """
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.last_loop_lag = lag
+            self.observe("event_loop_lag_seconds", lag)
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        """ Serve ``/metrics`` over HTTP. """
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+class StartupTimer:
+    """ Records when each startup phase finished, relative to ``start``. """
+
+    def __init__(self, metrics: Metrics, start: float):
+        self.metrics = metrics
+        self.start = start
+        self.phases: dict[str, float] = {}
+
+    def mark(self, phase: str) -> float:
+        """ Record the end of a phase, only the first time it is reached. """
+        if phase not in self.phases:
+            self.phases[phase] = time.perf_counter() - self.start
+            self.metrics.set("startup_phase_seconds", self.phases[phase], phase=phase)
+        return self.phases[phase]
+
+    def summary(self) -> str:
+        return ", ".join(f"{phase} {elapsed:.2f}s" for phase, elapsed in self.phases.items())
+
+
+def lavalink_endpoint(path: str) -> str:
+    """ Collapse a Lavalink REST path into a low-cardinality label. """
+    path = re.sub(r"^/v\d+/", "", path)
+    if path.startswith("sessions/"):
+        return "players" if "/players" in path else "session"
+    return path.strip("/") or "root"
+
+
+metrics = Metrics()
+metrics.describe("command_seconds", "histogram", "Total latency of app commands")
+metrics.describe("command_segment_seconds", "histogram", "Latency of segments (defer, ensure_voice, get_tracks) within app commands")
+metrics.describe("lavalink_request_seconds", "histogram", "Latency of Lavalink REST requests")
+metrics.describe("lavalink_request_errors_total", "counter", "Failed Lavalink REST requests")
+metrics.describe("event_loop_lag_seconds", "histogram", "Event loop scheduling lag")
+metrics.describe("idle_disconnects_total", "counter", "Players disconnected for being idle or alone")
+metrics.describe("message_edits_total", "counter", "Message edits sent by the edit scheduler")
+metrics.describe("coalesced_commands_total", "counter", "Commands coalesced with an identical one already in progress")
+metrics.describe("admission_rejected_total", "counter", "Requests shed by admission control")
+metrics.describe("prefetch_checks_total", "counter", "Upcoming queue entries checked before playing, by result")
+metrics.describe("voice_reconnects_total", "counter", "Voice servers lost, by whether the voice connection came back")
+metrics.describe("node_session_resumes_total", "counter", "Lavalink Nodes that came back, by whether their session was resumed")
+metrics.describe("autoplay_tracks_total", "counter", "Related tracks queued by autoplay")
+metrics.describe("autocomplete_seconds", "histogram", "Latency of query autocomplete responses")
+metrics.describe("startup_phase_seconds", "gauge", "Seconds from process start until each startup phase finished")
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import logging
+
+import lavalink
+from lavalink.nodemanager import DEFAULT_REGIONS
+
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# Discord RTC regions served by each node region tag
+REGIONS = {"hk": ("hongkong",), **DEFAULT_REGIONS}
+
+
+def parse_nodes(raw: str | None, host: str | None, port: str | None, password: str | None) -> list[dict]:
+    """
+    Parse the node list from ``LAVALINK_NODES``, a JSON array of objects with
+    ``host``, ``port``, ``password`` and optional ``region``, ``name`` and ``ssl`` keys.
+    Falls back to a single node built from ``LAVALINK_HOST/PORT/PW``.
+    """
+    if not raw:
+        return [{"host": host, "port": port, "password": password, "region": "hk", "name": "default-node"}]
+
+    nodes = []
+    for i, node in enumerate(json.loads(raw)):
+        nodes.append({
+            "host": node["host"],
+            "port": int(node["port"]),
+            "password": node["password"],
+            "region": node.get("region", "hk"),
+            "name": node.get("name", f"node-{i}"),
+            "ssl": node.get("ssl", False),
+        })
+    return nodes
+
+
+class NodePool(lavalink.NodeManager):
+    """
+    Node manager that places players on the least loaded node.
+
+    Lavalink only reports stats once a minute, so players placed since the last
+    stats update are counted locally to stop a burst of new players from all
+    landing on the same node.
+
+    With ``resume_grace`` set, a node that disconnects keeps its players for
+    that long so it can resume its session. Resumed players only get their held
+    back voice updates replayed, and players of an expired session are recreated
+    at their last position. Either way nothing is torn down or replayed from the
+    start.
+    """
+
+    def __init__(self, client: lavalink.Client, regions: dict | None = None, resume_grace: float = 0):
+        super().__init__(client, regions or REGIONS, False)
+        self._placements: dict[lavalink.Node, tuple[object, int]] = {}
+        # Seconds a disconnected node with a resumable session gets to come back before its players are moved
+        self.resume_grace = resume_grace
+        # node -> session id it had when it disconnected
+        self._resuming: dict[lavalink.Node, str] = {}
+
+    def load(self, node: lavalink.Node) -> float:
+        """ Return the node's penalty including players placed since its last stats update. """
+        stats, placed = self._placements.get(node, (None, 0))
+        if stats is not node.stats:
+            placed = 0
+        return node.penalty + placed
+
+    def region_for(self, rtc_region: str | None) -> str | None:
+        """ Map a Discord voice channel RTC region to a node region tag. """
+        if not rtc_region:
+            return None
+        for key, rtc_regions in self.regions.items():
+            if rtc_region in rtc_regions:
+                return key
+        return None
+
+    def find_ideal_node(self, region: str | None = None, exclude: list | None = None) -> lavalink.Node | None:
+        exclusions = exclude or []
+        nodes = None
+        if region:
+            nodes = [n for n in self.available_nodes if n.region == region and n not in exclusions]
+        # Fall back to every healthy node if the region has none
+        if not nodes:
+            nodes = [n for n in self.available_nodes if n not in exclusions]
+        if not nodes:
+            return None
+
+        best_node = min(nodes, key=self.load)
+        stats, placed = self._placements.get(best_node, (None, 0))
+        if stats is not best_node.stats:
+            stats, placed = best_node.stats, 0
+        self._placements[best_node] = (stats, placed + 1)
+        return best_node
+
+    async def failover(self, node: lavalink.Node) -> int:
+        """
+        Move any players still attached to ``node`` onto a healthy node.
+        Players resume at their last position. Returns the number of players moved.
+        """
+        moved = 0
+        for player in node.players:
+            best_node = self.find_ideal_node(node.region, exclude=[node])
+            if not best_node:
+                # Lavalink.py moves queued players once a node becomes ready again
+                if player not in self._player_queue:
+                    self._player_queue.append(player)
+                continue
+            try:
+                await player.change_node(best_node)
+                moved += 1
+            except lavalink.errors.ClientError as e:
+                log.error(f"Failed to move player {player.guild_id} to node '{best_node.name}': {e}")
+        return moved
+
+    async def _handle_node_disconnect(self, node: lavalink.Node):
+        for player in node.players:
+            try:
+                await player.node_unavailable()
+            except Exception as e:
+                log.error(f"Error while marking player {player.guild_id} unavailable: {e}")
+
+        # Without resuming, players are spread over the healthy nodes right away
+        if not self.resume_grace or node.session_id is None:
+            moved = await self.failover(node)
+            if moved:
+                log.info(f"Moved {moved} players from Lavalink Node '{node.name}'")
+            if node.players:
+                log.warning(f"{len(node.players)} players waiting for an available Lavalink Node")
+            return
+
+        # Lavalink keeps playing while the session waits to be resumed, so the players stay put for now
+        self._resuming[node] = node.session_id
+        asyncio.create_task(self._failover_later(node, node.session_id))
+
+    async def _failover_later(self, node: lavalink.Node, session_id: str):
+        await asyncio.sleep(self.resume_grace)
+        if node.available or self._resuming.get(node) != session_id:
+            return
+        moved = await self.failover(node)
+        log.warning(f"Lavalink Node '{node.name}' did not come back within {self.resume_grace}s, moved {moved} players")
+
+    async def _handle_node_ready(self, node: lavalink.Node):
+        session_id = self._resuming.pop(node, None)
+        if session_id is not None:
+            resumed = session_id == node.session_id
+            players = node.players
+            # Players waiting for this node are handled here rather than moved onto it from scratch
+            self._player_queue[:] = [player for player in self._player_queue if player.node is not node]
+            for player in players:
+                try:
+                    if resumed:
+                        # Still playing on the node, only voice updates sent in the meantime are missing
+                        player._internal_pause = False
+                        await player.replay_voice_update()
+                    else:
+                        # The session expired, recreate the player at its last position
+                        await player.change_node(node)
+                except Exception as e:
+                    log.error(f"Failed to resume player {player.guild_id} on node '{node.name}': {e}")
+            metrics.inc("node_session_resumes_total", result="resumed" if resumed else "expired")
+            log.info(f"{'Resumed' if resumed else 'Recreated'} {len(players)} players on Lavalink Node '{node.name}'")
+        await super()._handle_node_ready(node)
@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+
+import discord
+
+from metrics import metrics
+from queue_pages import format_duration
+
+log = logging.getLogger(__name__)
+
+BAR_WIDTH = 20
+
+
+def progress_bar(position: int, duration: int, width: int = BAR_WIDTH) -> str:
+    filled = min(width, int(width * position / duration)) if duration > 0 else 0
+    return "▬" * filled + "🔘" + "▬" * (width - filled)
+
+
+def now_playing_embed(player, requester: discord.User | None = None) -> discord.Embed:
+    """ Build the now playing embed of a player, or an idle embed if nothing is playing. """
+    embed = discord.Embed(title="Now Playing", color=0x22a7f2)
+    if player is None or player.current is None:
+        embed.add_field(name="", value="Nothing is playing.", inline=False)
+        return embed
+
+    track = player.current
+    embed.add_field(name="", value=f"[{track.title}]({track.uri})", inline=False)
+    if track.is_stream:
+        embed.add_field(name="", value="`LIVE`", inline=False)
+    else:
+        position = format_duration(player.position)
+        duration = format_duration(track.duration)
+        state = "⏸️" if player.paused else "▶️"
+        embed.add_field(name="", value=f"{state} {progress_bar(player.position, track.duration)} `{position}/{duration}`", inline=False)
+    embed.set_thumbnail(url=track.artwork_url)
+    if requester:
+        embed.set_footer(text=f"Requested by: {requester.display_name}", icon_url=requester.display_avatar.url)
+    return embed
+
+
+class EditScheduler:
+    """
+    Sends message edits from a single task, coalesced and rate limited.
+
+    Only the latest edit submitted for a key is kept and it is rendered when it
+    is sent, so a message that changes many times while waiting still costs one
+    edit. Edits in the same channel are spaced ``channel_interval`` seconds apart
+    and all edits together are paced to ``global_rate`` per second.
+    """
+
+    def __init__(self, channel_interval: float = 1.2, global_rate: float = 25, concurrency: int = 10):
+        self.channel_interval = channel_interval
+        self.global_rate = global_rate
+        # key -> (channel id, edit coroutine function)
+        self._pending: dict[Hashable, tuple[int, Callable[[], Awaitable]]] = {}
+        # (ready time, sequence, key), entries of discarded keys are skipped when popped
+        self._heap: list[tuple[float, int, Hashable]] = []
+        self._channel_next: dict[int, float] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def submit(self, key: Hashable, channel_id: int, edit: Callable[[], Awaitable]):
+        """ Schedule ``edit()``, replacing any edit still pending for ``key``. """
+        if key not in self._pending:
+            ready = max(time.monotonic(), self._channel_next.get(channel_id, 0.0))
+            heapq.heappush(self._heap, (ready, next(self._seq), key))
+            self._wakeup.set()
+        self._pending[key] = (channel_id, edit)
+
+    def discard(self, key: Hashable):
+        self._pending.pop(key, None)
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            ready, _, key = self._heap[0]
+            now = time.monotonic()
+            if ready > now:
+                # Wake up early if an edit that is ready sooner is submitted
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), ready - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            entry = self._pending.get(key)
+            if entry is None:
+                continue
+            channel_id, edit = entry
+            channel_next = self._channel_next.get(channel_id, 0.0)
+            if channel_next > now:
+                # Another edit went to this channel since this one was queued
+                heapq.heappush(self._heap, (channel_next, next(self._seq), key))
+                continue
+
+            del self._pending[key]
+            self._channel_next[channel_id] = now + self.channel_interval
+            if len(self._channel_next) > 1024 + 2 * len(self._pending):
+                self._channel_next = {c: t for c, t in self._channel_next.items() if t > now}
+
+            await self._semaphore.acquire()
+            asyncio.create_task(self._send(key, edit))
+            await asyncio.sleep(1 / self.global_rate)
+
+    async def _send(self, key: Hashable, edit: Callable[[], Awaitable]):
+        try:
+            await edit()
+            metrics.inc("message_edits_total")
+        except Exception as e:
+            log.error(f"Error while editing message {key}: {e}")
+        finally:
+            self._semaphore.release()
+
+
+class Panel:
+    __slots__ = ("channel_id", "message", "edited_at", "closed")
+
+    def __init__(self, channel_id: int, message: discord.Message):
+        self.channel_id = channel_id
+        self.message = message
+        self.edited_at = time.monotonic()
+        self.closed = False
+
+
+class NowPlayingPanels:
+    """
+    Live now playing messages, at most one per guild.
+
+    Track changes are edited in as soon as the channel's rate limit allows,
+    progress refreshes at most every ``interval`` seconds. All edits go through
+    a shared EditScheduler.
+    """
+
+    def __init__(self, bot: discord.Client, scheduler: EditScheduler, interval: float = 15):
+        self.bot = bot
+        self.scheduler = scheduler
+        self.interval = interval
+        self._panels: dict[int, Panel] = {}
+
+    def __len__(self) -> int:
+        return len(self._panels)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._panels
+
+    def render(self, guild_id: int) -> discord.Embed:
+        player = self.bot.lavalink.player_manager.get(guild_id)
+        requester = self.bot.get_user(player.current.requester) if player and player.current else None
+        return now_playing_embed(player, requester)
+
+    async def open(self, guild_id: int, channel: discord.abc.Messageable) -> discord.Message:
+        """ Post a new panel in ``channel``, replacing the guild's previous one. """
+        old = self._panels.pop(guild_id, None)
+        self.scheduler.discard(guild_id)
+        if old is not None:
+            try:
+                await old.message.delete()
+            except discord.HTTPException:
+                pass
+        message = await channel.send(embed=self.render(guild_id))
+        self._panels[guild_id] = Panel(channel.id, message)
+        return message
+
+    def update(self, guild_id: int, progress: bool = False):
+        """ Queue a refresh of the guild's panel, progress-only refreshes are throttled. """
+        panel = self._panels.get(guild_id)
+        if panel is None or panel.closed:
+            return
+        if progress and time.monotonic() - panel.edited_at < self.interval:
+            return
+        self.scheduler.submit(guild_id, panel.channel_id, lambda: self._edit(guild_id, panel))
+
+    def close(self, guild_id: int):
+        """ Show the panel as stopped one last time and forget it. """
+        panel = self._panels.get(guild_id)
+        if panel is None:
+            return
+        panel.closed = True
+        self.scheduler.submit(guild_id, panel.channel_id, lambda: self._edit(guild_id, panel))
+
+    async def _edit(self, guild_id: int, panel: Panel):
+        if self._panels.get(guild_id) is not panel:
+            return
+        panel.edited_at = time.monotonic()
+        if panel.closed:
+            del self._panels[guild_id]
+            embed = now_playing_embed(None)
+        else:
+            embed = self.render(guild_id)
+        try:
+            panel.message = await panel.message.edit(embed=embed)
+        except discord.NotFound:
+            # The panel was deleted by someone
+            if self._panels.get(guild_id) is panel:
+                del self._panels[guild_id]
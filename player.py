@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from random import randrange
+
+import aiohttp
+import lavalink
+
+from playlist_loader import PlaylistLoad
+from queue_pages import QueuePages
+from queued_track import EncodedTrackQueue, QueuedTrack, decode_many
+
+log = logging.getLogger(__name__)
+
+
+class Player(lavalink.DefaultPlayer):
+    """ DefaultPlayer backed by a TrackQueue of compact, lazily decoded entries. """
+
+    def __init__(self, guild_id: int, node: lavalink.Node):
+        super().__init__(guild_id, node)
+        self.queue: EncodedTrackQueue = EncodedTrackQueue()
+        self.queue_pages = QueuePages(self.queue, self.decode)
+        # Background playlist loads, each appending after the one started before it
+        self.playlist_loads: list[PlaylistLoad] = []
+        # Entry picked in advance to play next while shuffling, so it can be prefetched
+        self.planned_next: QueuedTrack | None = None
+        # Set when a voice update couldn't reach the node, it is sent again once the node is back
+        self.voice_update_pending = False
+
+    def index_of(self, entry: QueuedTrack, hint: int = 0) -> int:
+        """ Position of this exact entry in the queue, or -1. Checks ``hint`` first. """
+        if 0 <= hint < len(self.queue) and self.queue[hint] is entry:
+            return hint
+        return next((i for i, queued in enumerate(self.queue) if queued is entry), -1)
+
+    def upcoming(self, count: int) -> list[QueuedTrack]:
+        """ The entries that will play next. While shuffling only the next one is known, it is picked now. """
+        if not self.queue or self.loop == 1:
+            return []
+        if not self.shuffle:
+            return self.queue[:count]
+        if self.planned_next is None or self.index_of(self.planned_next) < 0:
+            self.planned_next = self.queue[randrange(len(self.queue))]
+        return [self.planned_next]
+
+    async def play(self, track=None, **kwargs):
+        # Play the entry picked in advance instead of a new random one
+        planned, self.planned_next = self.planned_next, None
+        if track is None and self.shuffle and planned is not None and not (self.loop == 1 and self.current):
+            index = self.index_of(planned)
+            if index >= 0:
+                track = self.queue.pop(index)
+        return await super().play(track, **kwargs)
+
+    async def decode(self, entries: list[QueuedTrack]) -> list[lavalink.AudioTrack | None]:
+        """ Decode queue entries into full tracks, None for entries that can't be decoded. """
+        return await decode_many(self.node, [(entry.encoded, entry.requester) for entry in entries])
+
+    async def play_track(self, track, *args, **kwargs):
+        # Queue entries are only decoded into a full track once they are about to play
+        if isinstance(track, QueuedTrack):
+            decoded = (await self.decode([track]))[0]
+            if decoded is None:
+                log.warning(f"Skipping undecodable track {track.identifier} in guild {self.guild_id}")
+                # play() already requeued the previous track for a queue loop, don't let it do so again
+                self.current = None
+                return await self.play()
+            track = decoded
+        return await super().play_track(track, *args, **kwargs)
+
+    async def _dispatch_voice_update(self):
+        # Hold voice updates while the node is away instead of losing them
+        if not self.node.available:
+            self.voice_update_pending = True
+            return
+        try:
+            await super()._dispatch_voice_update()
+        except (lavalink.errors.RequestError, lavalink.errors.ClientError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning(f"Could not send voice update of guild {self.guild_id}, it will be replayed: {e}")
+            self.voice_update_pending = True
+        else:
+            self.voice_update_pending = False
+
+    async def replay_voice_update(self):
+        """ Send the voice update held back while the node was away, if any. """
+        if self.voice_update_pending:
+            await self._dispatch_voice_update()
+
+    def add_many(self, tracks: list[lavalink.AudioTrack], requester: int = 0, index: int | None = None):
+        """ Add several tracks to the queue in one operation. """
+        if requester != 0:
+            for track in tracks:
+                track.requester = requester
+
+        if index is None:
+            self.queue.extend(tracks)
+        else:
+            self.queue.insert_many(index, tracks)
+
+    def remove_duplicates(self) -> list[QueuedTrack]:
+        """ Remove every entry whose track is already queued earlier, returning the removed entries. """
+        seen = set()
+
+        def duplicate(entry: QueuedTrack) -> bool:
+            if entry.identifier in seen:
+                return True
+            seen.add(entry.identifier)
+            return False
+        return self.queue.remove_if(duplicate)
+
+    def remove_requester(self, requester: int) -> list[QueuedTrack]:
+        """ Remove every entry requested by ``requester``, returning the removed entries. """
+        return self.queue.remove_if(lambda entry: entry.requester == requester)
+
+    def load_playlist(self, load: PlaylistLoad, fetch):
+        """ Start loading a playlist in the background, queued after any load still in progress. """
+        self.playlist_loads = [running for running in self.playlist_loads if not running.done]
+        load.start(fetch, after=self.playlist_loads[-1].task if self.playlist_loads else None)
+        self.playlist_loads.append(load)
+
+    def cancel_playlist_load(self) -> bool:
+        """ Cancel every background playlist load. Returns whether any was running. """
+        loads, self.playlist_loads = self.playlist_loads, []
+        running = False
+        for load in loads:
+            if not load.done:
+                load.cancel()
+                running = True
+        return running
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from urllib.parse import parse_qs, urlparse
+
+import discord
+import lavalink
+
+log = logging.getLogger(__name__)
+
+YOUTUBE_HOSTS = ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com")
+
+# Number of tracks appended to the queue per batch, the loop yields between batches
+BATCH_SIZE = 100
+
+
+def first_track_url(query: str) -> str | None:
+    """
+    Return a URL for just the selected video of a YouTube playlist URL,
+    e.g. ``watch?v=ID&list=PL...``. Returns None if the query isn't one.
+    """
+    url = urlparse(query.strip())
+    params = parse_qs(url.query)
+    if "list" not in params:
+        return None
+
+    if url.hostname in YOUTUBE_HOSTS and "v" in params:
+        video_id = params["v"][0]
+    elif url.hostname == "youtu.be" and url.path.strip("/"):
+        video_id = url.path.strip("/")
+    else:
+        return None
+    return f"https://www.youtube.com/watch?v={video_id}"
+
+
+class PlaylistLoad:
+    """ Loads the rest of a playlist into a player's queue in the background. """
+
+    def __init__(self, player: lavalink.DefaultPlayer, query: str, requester: int, first: lavalink.AudioTrack,
+                 message: discord.WebhookMessage | None = None):
+        self.player = player
+        self.query = query
+        self.requester = requester
+        self.first = first
+        self.message = message
+        self.added = 0
+        self.task: asyncio.Task | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.task is not None and self.task.done()
+
+    def start(self, fetch, after: asyncio.Task | None = None) -> asyncio.Task:
+        """
+        Start loading, ``fetch`` is a coroutine function resolving a query to a LoadResult.
+        The tracks are only added once ``after``, a load started earlier, is done.
+        """
+        self.task = asyncio.create_task(self._run(fetch, after))
+        return self.task
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+
+    async def _run(self, fetch, after: asyncio.Task | None):
+        try:
+            result = await fetch(self.query)
+            if result.load_type != lavalink.LoadType.PLAYLIST:
+                await self._edit(f"Added `{self.first.title}` to the queue.")
+                return
+
+            # Keep each playlist in one piece, after the ones requested before it
+            if after is not None:
+                await asyncio.wait({after})
+            tracks = self._remaining(result)
+            for i in range(0, len(tracks), BATCH_SIZE):
+                batch = tracks[i:i + BATCH_SIZE]
+                self.player.add_many(batch, requester=self.requester)
+                self.added += len(batch)
+                # Let playback and other guilds' commands run between batches
+                await asyncio.sleep(0)
+
+            await self._edit(f"Added {self.added + 1} songs from **`{result.playlist_info.name}`** to the queue.")
+        except asyncio.CancelledError:
+            await self._edit(f"Stopped loading the playlist after {self.added + 1} songs.")
+            raise
+        except Exception as e:
+            log.error(f"Error while loading playlist: {e}")
+            await self._edit(f"Added `{self.first.title}` to the queue, but the rest of the playlist failed to load.")
+
+    def _remaining(self, result: lavalink.LoadResult) -> list[lavalink.AudioTrack]:
+        """ Return the playlist in order without the track that is already queued. """
+        tracks = result.tracks
+        selected = result.playlist_info.selected_track
+        if not 0 <= selected < len(tracks) or tracks[selected].identifier != self.first.identifier:
+            selected = next((i for i, t in enumerate(tracks) if t.identifier == self.first.identifier), -1)
+        if selected < 0:
+            return tracks
+        return tracks[:selected] + tracks[selected + 1:]
+
+    async def _edit(self, content: str):
+        if self.message is None:
+            return
+        try:
+            await self.message.edit(content=content)
+        except discord.HTTPException:
+            pass
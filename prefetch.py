@@ -0,0 +1,115 @@
+import asyncio
+import logging
+
+import lavalink
+
+from metrics import metrics
+from queued_track import QueuedTrack
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Checks the next entries of a queue shortly before the current track ends.
+
+    Once a player update reports less than ``window`` seconds left, the next
+    ``depth`` entries are resolved again through ``resolve``. Entries that no
+    longer load are dropped so they never reach Lavalink as a stuck or failing
+    track, and entries that resolve to a new encoded track are refreshed in place.
+    A player is checked again whenever its queue, shuffle or loop mode changed
+    since the last check.
+    """
+
+    def __init__(self, resolve, window: float = 20, depth: int = 2):
+        # Coroutine function (player, query) -> LoadResult
+        self.resolve = resolve
+        self.window = window
+        self.depth = depth
+        # guild_id -> (state the check ran for, task)
+        self._checks: dict[int, tuple[tuple, asyncio.Task]] = {}
+
+    def __len__(self) -> int:
+        return sum(1 for _, task in self._checks.values() if not task.done())
+
+    def on_position(self, player):
+        """ Called on player updates, starts a check once the current track is about to end. """
+        current = player.current
+        if current is None or current.is_stream or player.loop == 1:
+            return
+        if current.duration - player.position > self.window * 1000:
+            return
+
+        state = (id(current), player.queue.version, player.shuffle, player.loop)
+        previous = self._checks.get(player.guild_id)
+        if previous is not None:
+            if previous[0] == state:
+                return
+            previous[1].cancel()
+        task = asyncio.create_task(self._check(player))
+        self._checks[player.guild_id] = (state, task)
+        task.add_done_callback(lambda _: self._done(player.guild_id, task))
+
+    def invalidate(self, player):
+        """ The upcoming order changed, pick and check the next entries again. """
+        player.planned_next = None
+        self.discard(player.guild_id)
+        self.on_position(player)
+
+    def discard(self, guild_id: int):
+        """ Forget a player that was destroyed. """
+        previous = self._checks.pop(guild_id, None)
+        if previous is not None:
+            previous[1].cancel()
+
+    def _done(self, guild_id: int, task: asyncio.Task):
+        # Finished checks stay in _checks to remember the state they ran for
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"Error while prefetching for guild {guild_id}: {task.exception()}")
+
+    async def _check(self, player):
+        for entry in player.upcoming(self.depth):
+            result = await self._validate(player, entry)
+            metrics.inc("prefetch_checks_total", result=result)
+
+    async def _validate(self, player, entry: QueuedTrack) -> str:
+        track = (await player.decode([entry]))[0]
+        if track is None:
+            return self._drop(player, entry, "undecodable")
+        if not track.uri:
+            return "skipped"
+
+        try:
+            result = await self.resolve(player, track.uri)
+        except Exception as e:
+            log.debug(f"Could not prefetch {track.uri}: {e}")
+            return "failed"
+
+        if result.load_type == lavalink.LoadType.EMPTY or \
+           result.load_type == lavalink.LoadType.ERROR and result.error.severity == lavalink.Severity.COMMON:
+            return self._drop(player, entry, "unavailable")
+        if result.load_type == lavalink.LoadType.ERROR:
+            # Suspicious or fault errors may be transient, keep the entry
+            return "failed"
+        if result.load_type != lavalink.LoadType.TRACK or result.tracks[0].track == entry.encoded:
+            return "ok"
+
+        # Swap in the freshly resolved track, keeping its place and requester
+        fresh = QueuedTrack.from_track(result.tracks[0])
+        fresh.requester = entry.requester
+        index = player.index_of(entry)
+        if index < 0:
+            return "ok"
+        player.queue[index] = fresh
+        if player.planned_next is entry:
+            player.planned_next = fresh
+        return "refreshed"
+
+    def _drop(self, player, entry: QueuedTrack, reason: str) -> str:
+        index = player.index_of(entry)
+        if index >= 0:
+            del player.queue[index]
+            log.info(f"Dropped {reason} track {entry.identifier} from the queue of guild {player.guild_id}")
+        if player.planned_next is entry:
+            player.planned_next = None
+        return "dropped"
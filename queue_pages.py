@@ -0,0 +1,105 @@
+import discord
+import lavalink
+
+PAGE_SIZE = 10
+
+
+def format_duration(ms: int) -> str:
+    """ Format milliseconds as h:mm:ss, dropping the hours when there are none. """
+    duration = lavalink.utils.format_time(ms)
+    if duration.startswith("00:"):
+        duration = duration[3:]
+    return duration
+
+
+class QueuePages:
+    """
+    Lazily rendered pages of a queue.
+
+    Pages are only rendered when requested and are cached until the queue's
+    version changes, so browsing a large queue doesn't re-render it on every click.
+    """
+
+    def __init__(self, queue, decode):
+        self.queue = queue
+        # Coroutine function decoding queue entries into tracks, only the shown page is decoded
+        self.decode = decode
+        self._version = None
+        self._pages: dict[int, str] = {}
+        self._total_duration = None
+
+    def _sync(self):
+        if self._version != self.queue.version:
+            self._version = self.queue.version
+            self._pages.clear()
+            self._total_duration = None
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.queue) // PAGE_SIZE))
+
+    @property
+    def total_duration(self) -> int:
+        """ Total duration of the queued songs in milliseconds, streams excluded. """
+        self._sync()
+        if self._total_duration is None:
+            self._total_duration = sum(track.duration for track in self.queue if not track.is_stream)
+        return self._total_duration
+
+    async def render(self, page: int) -> str:
+        """ Render a 1-indexed page of the queue. """
+        self._sync()
+        text = self._pages.get(page)
+        if text is None:
+            version = self.queue.version
+            start = (page - 1) * PAGE_SIZE
+            entries = self.queue[start:start + PAGE_SIZE]
+            tracks = await self.decode(entries)
+            lines = []
+            for i, (entry, track) in enumerate(zip(entries, tracks), start=start + 1):
+                duration = "LIVE" if entry.is_stream else format_duration(entry.duration)
+                title = f"[{track.title}]({track.uri})" if track else "Unknown track"
+                lines.append(f"{i}. {title} - `{duration}`")
+            # Discord rejects embed fields with an empty value, e.g. once the queue is emptied while browsing
+            text = "\n".join(lines) or "Queue is empty."
+            # Don't cache a page rendered from a queue that changed while decoding
+            if self.queue.version == version:
+                self._sync()
+                self._pages[page] = text
+        return text
+
+    async def embed(self, page: int) -> discord.Embed:
+        page = min(max(page, 1), self.page_count)
+        embed = discord.Embed(title="Queue", color=0x22a7f2)
+        embed.add_field(name="", value=await self.render(page), inline=False)
+        embed.set_footer(text=f"Page {page}/{self.page_count} | {len(self.queue)} songs | {format_duration(self.total_duration)}")
+        return embed
+
+
+class QueueView(discord.ui.View):
+    """ Previous/next buttons for browsing queue pages. """
+
+    def __init__(self, pages: QueuePages, page: int = 1, timeout: float = 120):
+        super().__init__(timeout=timeout)
+        self.pages = pages
+        self.page = page
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.page = min(max(self.page, 1), self.pages.page_count)
+        self.previous.disabled = self.page <= 1
+        self.next.disabled = self.page >= self.pages.page_count
+
+    async def _show(self, interaction: discord.Interaction):
+        self._update_buttons()
+        await interaction.response.edit_message(embed=await self.pages.embed(self.page), view=self)
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page -= 1
+        await self._show(interaction)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.page += 1
+        await self._show(interaction)
@@ -0,0 +1,96 @@
+import lavalink
+
+from track_queue import TrackQueue
+
+
+def decode_track(encoded: str, requester: int = 0) -> lavalink.AudioTrack:
+    """ Decode an encoded track locally, without a round trip to Lavalink. """
+    info = lavalink.decode_track(encoded).raw["info"]
+    return lavalink.AudioTrack({"encoded": encoded, "info": info}, requester)
+
+
+async def decode_many(node: lavalink.Node, entries: list[tuple[str, int]]) -> list[lavalink.AudioTrack | None]:
+    """
+    Decode (encoded track, requester) pairs into tracks aligned with ``entries``.
+    Tracks the local decoder can't handle are decoded by the node in one
+    decodetracks request, and any that still fail are None.
+    """
+    tracks: list[lavalink.AudioTrack | None] = []
+    failed = []
+    for encoded, requester in entries:
+        try:
+            tracks.append(decode_track(encoded, requester))
+        except Exception:
+            failed.append(len(tracks))
+            tracks.append(None)
+
+    if failed:
+        try:
+            decoded = await node.decode_tracks(list(dict.fromkeys(entries[i][0] for i in failed)))
+        except lavalink.errors.RequestError:
+            decoded = []
+        # The node may leave out tracks it can't decode either, so match results by their encoded track
+        by_encoded = {track.track: track for track in decoded}
+        for i in failed:
+            encoded, requester = entries[i]
+            if encoded in by_encoded:
+                tracks[i] = lavalink.AudioTrack(by_encoded[encoded], requester)
+    return tracks
+
+
+class QueuedTrack:
+    """
+    Compact queue entry: the encoded track plus the few fields the queue itself
+    needs. Titles, URIs and artwork are decoded from ``encoded`` only when the
+    track is displayed or played.
+    """
+
+    __slots__ = ("encoded", "identifier", "duration", "is_stream", "requester")
+
+    def __init__(self, encoded: str, identifier: str, duration: int, is_stream: bool, requester: int = 0):
+        self.encoded = encoded
+        self.identifier = identifier
+        self.duration = duration
+        self.is_stream = is_stream
+        self.requester = requester
+
+    @classmethod
+    def from_track(cls, track: lavalink.AudioTrack) -> "QueuedTrack":
+        return cls(track.track, track.identifier, track.duration, track.is_stream, track.requester)
+
+    @property
+    def track(self) -> str:
+        """ The encoded track, named like ``AudioTrack.track``. """
+        return self.encoded
+
+    def __repr__(self) -> str:
+        return f"<QueuedTrack identifier={self.identifier} duration={self.duration}>"
+
+
+def compact(track) -> QueuedTrack:
+    return track if isinstance(track, QueuedTrack) else QueuedTrack.from_track(track)
+
+
+class EncodedTrackQueue(TrackQueue):
+    """ TrackQueue storing every entry as a QueuedTrack, whatever it was given. """
+
+    __slots__ = ()
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [compact(track) for track in value]
+        else:
+            value = compact(value)
+        super().__setitem__(index, value)
+
+    def insert(self, index: int, value):
+        super().insert(index, compact(value))
+
+    def insert_many(self, index: int, items):
+        super().insert_many(index, [compact(track) for track in items])
+
+    def append(self, value):
+        super().append(compact(value))
+
+    def extend(self, items):
+        super().extend([compact(track) for track in items])
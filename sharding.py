@@ -0,0 +1,31 @@
+def shard_for_guild(guild_id: int, shard_count: int) -> int:
+    """ Return the shard Discord routes a guild to. """
+    return (guild_id >> 22) % shard_count
+
+
+def shard_ranges(shard_count: int, workers: int) -> list[list[int]]:
+    """ Split shard ids into contiguous, evenly sized ranges, one per worker. """
+    workers = max(1, min(workers, shard_count))
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def parse_shard_ids(raw: str | None) -> list[int] | None:
+    """ Parse a comma separated ``SHARD_IDS`` value such as ``0,1,2`` or ``0-3``. """
+    if not raw:
+        return None
+    shard_ids = []
+    for part in raw.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-")
+            shard_ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            shard_ids.append(int(part))
+    return shard_ids
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import lavalink
+
+from queued_track import decode_many
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    guild_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    current TEXT,
+    current_requester INTEGER,
+    position INTEGER NOT NULL DEFAULT 0,
+    paused INTEGER NOT NULL DEFAULT 0,
+    volume INTEGER NOT NULL DEFAULT 100,
+    loop INTEGER NOT NULL DEFAULT 0,
+    shuffle INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queues (
+    guild_id INTEGER PRIMARY KEY,
+    tracks TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS announcements (
+    guild_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    tracks TEXT NOT NULL,
+    PRIMARY KEY (guild_id, channel_id, url)
+);
+CREATE TABLE IF NOT EXISTS history (
+    guild_id INTEGER PRIMARY KEY,
+    tracks TEXT NOT NULL,
+    autoplay INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class PlayerSnapshot:
+    """ Saved state of a single guild's player. """
+    __slots__ = ("guild_id", "channel_id", "current", "current_requester", "position", "paused",
+                 "volume", "loop", "shuffle", "queue")
+
+    def __init__(self, guild_id, channel_id, current, current_requester, position, paused, volume, loop, shuffle, queue):
+        self.guild_id: int = guild_id
+        self.channel_id: int = channel_id
+        self.current: str | None = current
+        self.current_requester: int = current_requester or 0
+        self.position: int = position
+        self.paused: bool = bool(paused)
+        self.volume: int = volume
+        self.loop: int = loop
+        self.shuffle: bool = bool(shuffle)
+        # List of (encoded track, requester) pairs
+        self.queue: list[tuple[str, int]] = queue
+
+
+class StateStore:
+    """
+    SQLite store for player snapshots.
+
+    All database work runs on a single background thread so the event loop
+    never blocks on disk. Snapshots are incremental: the player row (position,
+    flags) is cheap and always written, while a queue is only re-serialized
+    when its version changed since the last snapshot.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self._conn: sqlite3.Connection | None = None
+        # guild_id -> (queue object id, queue version) as of the last snapshot
+        self._queue_versions: dict[int, tuple[int, int]] = {}
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def open(self):
+        await self._run(self._connect)
+
+    async def close(self):
+        if self._executor._shutdown:
+            return
+
+        def close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        await self._run(close)
+        self._executor.shutdown(wait=True)
+
+    async def save(self, players, owns=None):
+        """
+        Snapshot the given players, removing rows of guilds that no longer have one.
+        ``owns`` limits removal to guild ids this process is responsible for,
+        so workers sharing a database don't delete each other's rows.
+        """
+        rows = []
+        queues = []
+        versions = {}
+        now = time.time()
+        for player in players:
+            if not player.is_connected:
+                continue
+            current = player.current
+            rows.append((player.guild_id, player.channel_id, current.track if current else None,
+                         current.requester if current else 0, player.position, int(player.paused),
+                         player.volume, player.loop, int(player.shuffle), now))
+
+            version = (id(player.queue), getattr(player.queue, "version", None))
+            if version[1] is None or self._queue_versions.get(player.guild_id) != version:
+                queues.append((player.guild_id, json.dumps([(t.track, t.requester) for t in player.queue])))
+                versions[player.guild_id] = version
+
+        active = {row[0] for row in rows}
+
+        def write():
+            conn = self._connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.executemany("INSERT OR REPLACE INTO queues VALUES (?, ?)", queues)
+                # Forget guilds whose player went away since the last snapshot
+                stale = [(guild_id,) for (guild_id,) in conn.execute("SELECT guild_id FROM players")
+                         if guild_id not in active and (owns is None or owns(guild_id))]
+                conn.executemany("DELETE FROM players WHERE guild_id = ?", stale)
+                conn.executemany("DELETE FROM queues WHERE guild_id = ?", stale)
+        await self._run(write)
+
+        # Only queues that made it to disk count as saved, a failed write is retried by the next snapshot
+        self._queue_versions.update(versions)
+        for guild_id in self._queue_versions.keys() - active:
+            del self._queue_versions[guild_id]
+
+    async def load(self) -> list[PlayerSnapshot]:
+        """ Load every saved player snapshot. """
+        def read():
+            conn = self._connect()
+            queues = dict(conn.execute("SELECT guild_id, tracks FROM queues"))
+            return [
+                PlayerSnapshot(*row, queue=[tuple(t) for t in json.loads(queues.get(row[0], "[]"))])
+                for row in conn.execute("SELECT guild_id, channel_id, current, current_requester, position, paused, "
+                                        "volume, loop, shuffle FROM players")
+            ]
+        return await self._run(read)
+
+    async def get_announcement(self, guild_id: int, channel_id: int, url: str) -> tuple[int, list[str]] | None:
+        """ Return the (message id, track identifiers) of a playlist's announcement in a channel. """
+        def read():
+            row = self._connect().execute(
+                "SELECT message_id, tracks FROM announcements WHERE guild_id = ? AND channel_id = ? AND url = ?",
+                (guild_id, channel_id, url)).fetchone()
+            return (row[0], json.loads(row[1])) if row else None
+        return await self._run(read)
+
+    async def set_announcement(self, guild_id: int, channel_id: int, url: str, message_id: int, tracks: list[str]):
+        def write():
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO announcements VALUES (?, ?, ?, ?, ?)",
+                             (guild_id, channel_id, url, message_id, json.dumps(tracks)))
+        await self._run(write)
+
+    async def save_history(self, rows: list[tuple[int, list[tuple[str, int]], bool]]):
+        """ Write (guild id, (encoded track, requester) pairs, autoplay) history rows. """
+        if not rows:
+            return
+        rows = [(guild_id, json.dumps(tracks), int(autoplay)) for guild_id, tracks, autoplay in rows]
+
+        def write():
+            with self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?, ?)", rows)
+        await self._run(write)
+
+    async def load_history(self) -> list[tuple[int, list[tuple[str, int]], bool]]:
+        def read():
+            return [(guild_id, [tuple(t) for t in json.loads(tracks)], bool(autoplay))
+                    for guild_id, tracks, autoplay in self._connect().execute("SELECT guild_id, tracks, autoplay FROM history")]
+        return await self._run(read)
+
+    async def get_meta(self, key: str) -> str | None:
+        def read():
+            row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else None
+        return await self._run(read)
+
+    async def set_meta(self, key: str, value: str):
+        def write():
+            with self._connect() as conn:
+                conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+        await self._run(write)
+
+
+async def decode_tracks(node: lavalink.Node, entries: list[tuple[str, int]]) -> list[lavalink.AudioTrack]:
+    """ Decode saved (encoded track, requester) pairs, preserving order and skipping any that fail. """
+    return [track for track in await decode_many(node, entries) if track is not None]
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from functools import lru_cache
+
+import lavalink
+
+from history import PlayHistory
+
+# Discord shows at most 25 choices, and names and values are limited to 100 characters
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def is_url(text: str) -> bool:
+    return text.startswith(("http://", "https://"))
+
+
+@lru_cache(maxsize=4096)
+def describe(encoded: str) -> tuple[str, str, str | None]:
+    """ The (search key, title, uri) of an encoded track, decoded once and remembered. """
+    try:
+        info = lavalink.decode_track(encoded).raw["info"]
+    except Exception:
+        return "", "", None
+    return normalize(f"{info['author']} {info['title']}"), info["title"], info["uri"]
+
+
+class PrefixIndex:
+    """
+    Sorted (key, value) pairs searched by prefix with bisect.
+
+    Each value is stored under a few keys, e.g. "title" and "author title".
+    Once more than ``max_values`` values are indexed, the least recently added
+    one is evicted.
+    """
+
+    def __init__(self, max_values: int = 20000):
+        self.max_values = max_values
+        self._keys: list[tuple[str, str]] = []
+        # value -> (display name, keys)
+        self._values: OrderedDict[str, tuple[str, tuple[str, ...]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def add(self, name: str, value: str, keys: tuple[str, ...]):
+        if value in self._values:
+            self._values.move_to_end(value)
+            return
+        keys = tuple(dict.fromkeys(normalize(key) for key in keys if key))
+        for key in keys:
+            insort(self._keys, (key, value))
+        self._values[value] = (name, keys)
+        while len(self._values) > self.max_values:
+            old_value, (_, old_keys) = self._values.popitem(last=False)
+            for key in old_keys:
+                i = bisect_left(self._keys, (key, old_value))
+                if i < len(self._keys) and self._keys[i] == (key, old_value):
+                    del self._keys[i]
+
+    def search(self, prefix: str, limit: int) -> list[tuple[str, str]]:
+        """ Return up to ``limit`` (name, value) pairs with a key starting with ``prefix``. """
+        results = []
+        seen = set()
+        i = bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(results) < limit:
+            key, value = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            if value not in seen:
+                seen.add(value)
+                results.append((self._values[value][0], value))
+            i += 1
+        return results
+
+
+class Suggester:
+    """
+    Autocomplete suggestions for track queries.
+
+    Suggestions come from the guild's play history first, then from a
+    prefix index of every track played or resolved by this process. When those
+    find too little, a search is sent upstream, but only once the user paused
+    typing for ``debounce`` seconds and only for as long as the ``budget`` of the
+    autocomplete response allows. A search still running when the budget runs
+    out is left to finish, so its results are local by the next keystroke.
+    """
+
+    def __init__(self, search, history: PlayHistory, max_values: int = 20000, min_local: int = 5,
+                 debounce: float = 0.35, budget: float = 2.5):
+        # Coroutine function (guild_id, query) -> LoadResult
+        self.search = search
+        self.history = history
+        self.index = PrefixIndex(max_values)
+        self.min_local = min_local
+        self.debounce = debounce
+        self.budget = budget
+        # user_id -> token of the user's latest autocomplete request
+        self._latest: dict[int, object] = {}
+
+    def add_track(self, track: lavalink.AudioTrack):
+        if not track.uri:
+            return
+        self.index.add(track.title, track.uri, (track.title, f"{track.author} {track.title}"))
+
+    def add_result(self, query: str, result: lavalink.LoadResult):
+        """ Index a resolved query, the top results of a search and the name of a playlist. """
+        if result.load_type == lavalink.LoadType.PLAYLIST and is_url(query):
+            self.index.add(result.playlist_info.name, query, (result.playlist_info.name,))
+        elif result.load_type in (lavalink.LoadType.TRACK, lavalink.LoadType.SEARCH):
+            for track in result.tracks[:5]:
+                self.add_track(track)
+
+    def local(self, guild_id: int, text: str, limit: int = MAX_CHOICES) -> list[tuple[str, str]]:
+        results = []
+        seen = set()
+        for entry in self.history.get(guild_id):
+            key, name, uri = describe(entry.encoded)
+            if uri and text in key and uri not in seen:
+                seen.add(uri)
+                results.append((name, uri))
+                if len(results) >= limit:
+                    return results
+        for name, uri in self.index.search(text, limit):
+            if uri not in seen:
+                results.append((name, uri))
+                if len(results) >= limit:
+                    break
+        return results
+
+    async def suggest(self, guild_id: int, user_id: int, current: str) -> list[tuple[str, str]]:
+        """ Return (name, value) suggestions for what the user typed so far. """
+        start = time.monotonic()
+        text = normalize(current)
+        results = self.local(guild_id, text)
+        if len(results) >= self.min_local or len(text) < 3 or is_url(text):
+            return results
+
+        # Only the latest keystroke of a user may search upstream
+        token = self._latest[user_id] = object()
+        await asyncio.sleep(self.debounce)
+        if self._latest.get(user_id) is not token:
+            return results
+        del self._latest[user_id]
+
+        search = asyncio.ensure_future(self.search(guild_id, f"ytsearch:{current.strip()}"))
+        try:
+            result = await asyncio.wait_for(asyncio.shield(search), self.budget - (time.monotonic() - start))
+        except asyncio.TimeoutError:
+            search.add_done_callback(lambda task: task.cancelled() or task.exception())
+            return results
+        except Exception:
+            return results
+
+        seen = {uri for _, uri in results}
+        for track in result.tracks:
+            if len(results) >= MAX_CHOICES:
+                break
+            if track.uri and track.uri not in seen:
+                seen.add(track.uri)
+                results.append((track.title, track.uri))
+        return results
@@ -0,0 +1,48 @@
+"""
+Player restore against the fake Lavalink node and Discord stand-ins of the benchmark.
+
+    python -m pytest tests
+"""
+import asyncio
+from types import SimpleNamespace
+
+from bench import fake_lavalink
+from bench.fake_discord import FakeGuild
+from bench.run import Benchmark
+
+
+async def restore_stop_snapshot():
+    _, runner, port = await fake_lavalink.start()
+    benchmark = Benchmark(SimpleNamespace(seed=0))
+    client = await benchmark.setup_bot("127.0.0.1", port)
+    bot = benchmark.bot_module
+    await bot.state_store.open()
+    guild = FakeGuild(client)
+    benchmark.channels[guild.voice_channel.id] = guild.voice_channel
+    client.get_guild = {guild.id: guild}.get
+    client._ready = asyncio.Event()
+    client._ready.set()
+    try:
+        await bot.play.callback(guild.interaction(), query="restored song")
+        await bot.snapshot_players()
+        assert [snapshot.guild_id for snapshot in await bot.state_store.load()] == [guild.id]
+
+        # Simulate a restart: the player goes away without a snapshot and is restored from the saved row
+        await client.lavalink.player_manager.destroy(guild.id)
+        guild.voice_client = None
+        await bot.restore_players()
+        assert client.lavalink.player_manager.get(guild.id) is not None
+        assert guild.id not in bot.pending_restores
+
+        # Stopping the restored player removes its row, so the next restart doesn't bring it back
+        await bot.stop.callback(guild.interaction())
+        await bot.snapshot_players()
+        assert await bot.state_store.load() == []
+    finally:
+        await client.lavalink.close()
+        await bot.state_store.close()
+        await runner.cleanup()
+
+
+def test_stopped_player_is_not_restored_again():
+    asyncio.run(restore_stop_snapshot())
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import math
+from typing import Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel running any number of keyed timers from a single task.
+
+    Timers are bucketed by the tick they expire on, so scheduling and cancelling
+    are O(1) and each tick only looks at one slot, however many timers are pending.
+    A key has at most one timer, scheduling it again replaces the previous one.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = tick
+        self._slots: list[dict[Hashable, tuple[int, Callable]]] = [{} for _ in range(slots)]
+        # key -> tick the timer expires on
+        self._timers: dict[Hashable, int] = {}
+        self._current = 0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key) -> bool:
+        return key in self._timers
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[Hashable], None]):
+        """ Call ``callback(key)`` after ``delay`` seconds, rounded up to whole ticks. """
+        self.cancel(key)
+        expires = self._current + max(1, math.ceil(delay / self.tick))
+        self._slots[expires % len(self._slots)][key] = (expires, callback)
+        self._timers[key] = expires
+
+    def cancel(self, key: Hashable) -> bool:
+        expires = self._timers.pop(key, None)
+        if expires is None:
+            return False
+        del self._slots[expires % len(self._slots)][key]
+        return True
+
+    def remaining(self, key: Hashable) -> float | None:
+        """ Seconds until the key's timer fires, or None if it has none. """
+        expires = self._timers.get(key)
+        return None if expires is None else (expires - self._current) * self.tick
+
+    def advance(self):
+        """ Move the wheel forward one tick and fire the timers that expired. """
+        self._current += 1
+        slot = self._slots[self._current % len(self._slots)]
+        # Timers more than a full turn away share the slot, they are left for a later round
+        expired = [(key, callback) for key, (expires, callback) in slot.items() if expires <= self._current]
+        for key, _ in expired:
+            del slot[key]
+            del self._timers[key]
+        for key, callback in expired:
+            try:
+                callback(key)
+            except Exception as e:
+                log.error(f"Error in timer callback for {key}: {e}")
+
+    def start(self) -> asyncio.Task:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick
+            # Ticks missed while the loop was blocked are caught up one after another
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            self.advance()
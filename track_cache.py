@@ -0,0 +1,164 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+import lavalink
+
+# Load types worth keeping around. Errors and empty results are never cached
+# so a retry after a transient upstream failure goes straight to Lavalink.
+CACHEABLE_LOAD_TYPES = (lavalink.LoadType.TRACK, lavalink.LoadType.PLAYLIST, lavalink.LoadType.SEARCH)
+
+# Rough per-track overhead (AudioTrack slots, info dict, extra dict) on top of its strings.
+TRACK_OVERHEAD_BYTES = 600
+
+
+def normalize_query(query: str) -> str:
+    """ Normalize a query so equivalent lookups share a cache entry. """
+    query = " ".join(query.split())
+    if query.startswith(("http://", "https://")):
+        return query
+    # Plain searches are case insensitive upstream
+    return query.lower()
+
+
+def estimate_size(result: lavalink.LoadResult) -> int:
+    """ Approximate the memory held by a load result, in bytes. """
+    size = 0
+    for track in result.tracks:
+        size += TRACK_OVERHEAD_BYTES + len(track.track or "") + len(track.title) + len(track.uri or "")
+    return size
+
+
+class _Entry:
+    __slots__ = ("result", "expires_at", "size")
+
+    def __init__(self, result: lavalink.LoadResult, expires_at: float, size: int):
+        self.result = result
+        self.expires_at = expires_at
+        self.size = size
+
+
+class TrackCache:
+    """ LRU + TTL cache of Lavalink load results with in-flight request coalescing. """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 900, max_bytes: int = 64 * 1024 * 1024, admission=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.size = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        # Optional AdmissionController that upstream requests must pass, hits and coalesced requests skip it
+        self.admission = admission
+        # Optional callback (query, result) for every result stored
+        self.on_put = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, query: str) -> bool:
+        entry = self._entries.get(normalize_query(query))
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+        }
+
+    def get(self, query: str) -> lavalink.LoadResult | None:
+        """ Return a copy of a cached result, or None if missing or expired. """
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return self._copy(entry.result)
+
+    def put(self, query: str, result: lavalink.LoadResult):
+        """ Store a load result if it is cacheable. """
+        if result.load_type not in CACHEABLE_LOAD_TYPES or not result.tracks:
+            return
+        key = normalize_query(query)
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = _Entry(result, time.monotonic() + self.ttl, size)
+        self.size += size
+        self._evict()
+        if self.on_put is not None:
+            self.on_put(key, result)
+
+    def invalidate(self, query: str):
+        key = normalize_query(query)
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    async def get_tracks(self, node: lavalink.Node, query: str) -> lavalink.LoadResult:
+        """ Resolve a query through the cache, sharing one upstream request between concurrent callers. """
+        key = normalize_query(query)
+        result = self.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # The lookup is owned by the cache, so a caller being cancelled never cancels it for the others
+            task = asyncio.create_task(self._fetch(node, query, key))
+            # Mark the exception as retrieved in case every caller was cancelled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+        return self._copy(await asyncio.shield(task))
+
+    async def _fetch(self, node: lavalink.Node, query: str, key: str) -> lavalink.LoadResult:
+        try:
+            if self.admission is None:
+                result = await node.get_tracks(query)
+            else:
+                async with self.admission.admit():
+                    result = await node.get_tracks(query)
+        finally:
+            del self._inflight[key]
+        self.put(key, result)
+        return result
+
+    def _copy(self, result: lavalink.LoadResult) -> lavalink.LoadResult:
+        # Callers set the requester on each track, so never hand out the cached instances
+        tracks = [lavalink.AudioTrack(track) for track in result.tracks]
+        return lavalink.LoadResult(result.load_type, tracks, result.playlist_info, result.plugin_info, result.error)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def _evict(self):
+        now = time.monotonic()
+        # Drop expired entries from the cold end first, then enforce the bounds
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now and len(self._entries) <= self.max_entries and self.size <= self.max_bytes:
+                break
+            self._remove(key)
+            self.evictions += 1
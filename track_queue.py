@@ -0,0 +1,215 @@
+from collections.abc import MutableSequence
+from itertools import chain, islice
+
+# Target block size. Blocks are split once they grow past twice this size.
+BLOCK_SIZE = 256
+
+
+class TrackQueue(MutableSequence):
+    """
+    List-like queue stored as a list of blocks.
+
+    Indexed access, insertion and removal cost O(n/B + B) instead of O(n),
+    bulk inserts cost O(k + n/B + B), and dropping the first k entries
+    releases whole blocks at once.
+
+    ``version`` is bumped on every mutation so callers can cheaply tell
+    whether the queue changed since they last looked at it.
+    """
+
+    __slots__ = ("_blocks", "_len", "version")
+
+    def __init__(self, items=()):
+        self._blocks: list[list] = []
+        self._len = 0
+        self.version = 0
+        self.extend(items)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        return chain.from_iterable(self._blocks)
+
+    def __repr__(self) -> str:
+        return f"<TrackQueue len={self._len}>"
+
+    def _locate(self, index: int) -> tuple[int, int]:
+        """ Return the (block, offset) pair for a normalized index. """
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("queue index out of range")
+        # Walk from whichever end is closer
+        if index < self._len // 2:
+            for b, block in enumerate(self._blocks):
+                if index < len(block):
+                    return b, index
+                index -= len(block)
+        else:
+            index = self._len - index
+            for b in range(len(self._blocks) - 1, -1, -1):
+                block = self._blocks[b]
+                if index <= len(block):
+                    return b, len(block) - index
+                index -= len(block)
+        raise IndexError("queue index out of range")
+
+    def _split(self, b: int):
+        """ Split block ``b`` if it has grown too large. """
+        block = self._blocks[b]
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[b:b + 1] = [block[i:i + BLOCK_SIZE] for i in range(0, len(block), BLOCK_SIZE)]
+
+    def _chunks(self, items: list) -> list[list]:
+        return [items[i:i + BLOCK_SIZE] for i in range(0, len(items), BLOCK_SIZE)]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            if start >= stop:
+                return []
+            b, offset = self._locate(start)
+            items = chain(islice(self._blocks[b], offset, None), chain.from_iterable(self._blocks[b + 1:]))
+            return list(islice(items, stop - start))
+        b, offset = self._locate(index)
+        return self._blocks[b][offset]
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            items = list(self)
+            items[index] = value
+            self.clear()
+            self.extend(items)
+            return
+        b, offset = self._locate(index)
+        self._blocks[b][offset] = value
+        self.version += 1
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                items = list(self)
+                del items[index]
+                self.clear()
+                self.extend(items)
+                return
+            self.remove_range(start, stop)
+            return
+        b, offset = self._locate(index)
+        del self._blocks[b][offset]
+        if not self._blocks[b]:
+            del self._blocks[b]
+        self._len -= 1
+        self.version += 1
+
+    def remove_range(self, start: int, stop: int) -> int:
+        """ Remove the entries in ``[start, stop)``, returning how many were removed. """
+        start, stop = max(start, 0), min(stop, self._len)
+        if start >= stop:
+            return 0
+        count = stop - start
+        b, offset = self._locate(start)
+        remaining = count
+        # Trim the first block, then drop or trim whole blocks after it
+        while remaining:
+            block = self._blocks[b]
+            take = min(len(block) - offset, remaining)
+            if offset == 0 and take == len(block):
+                del self._blocks[b]
+            else:
+                del block[offset:offset + take]
+                b += 1
+            remaining -= take
+            offset = 0
+        self._len -= count
+        self.version += 1
+        return count
+
+    def remove_if(self, predicate) -> list:
+        """ Remove every entry matching ``predicate`` in a single pass, returning the removed entries in order. """
+        kept = []
+        removed = []
+        for value in self:
+            (removed if predicate(value) else kept).append(value)
+        if removed:
+            self._blocks = self._chunks(kept)
+            self._len = len(kept)
+            self.version += 1
+        return removed
+
+    def move(self, index: int, to: int):
+        """ Move the entry at ``index`` so it ends up at position ``to``, returning it. """
+        value = self.pop(index)
+        self.insert(to, value)
+        return value
+
+    def insert(self, index: int, value):
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index >= self._len:
+            self.append(value)
+            return
+        b, offset = self._locate(index)
+        self._blocks[b].insert(offset, value)
+        self._len += 1
+        self.version += 1
+        self._split(b)
+
+    def insert_many(self, index: int, items):
+        """ Insert ``items`` in order before ``index``. """
+        items = list(items)
+        if not items:
+            return
+        if index < 0:
+            index = max(index + self._len, 0)
+        if index >= self._len:
+            self.extend(items)
+            return
+        b, offset = self._locate(index)
+        block = self._blocks[b]
+        new_blocks = self._chunks(items)
+        if offset:
+            # Split the block at the insertion point so the new blocks slot in between
+            new_blocks = [block[:offset]] + new_blocks + [block[offset:]]
+        else:
+            new_blocks.append(block)
+        self._blocks[b:b + 1] = new_blocks
+        self._len += len(items)
+        self.version += 1
+
+    def append(self, value):
+        if not self._blocks or len(self._blocks[-1]) >= BLOCK_SIZE:
+            self._blocks.append([])
+        self._blocks[-1].append(value)
+        self._len += 1
+        self.version += 1
+
+    def extend(self, items):
+        items = list(items)
+        if not items:
+            return
+        self._len += len(items)
+        self.version += 1
+        if self._blocks and len(self._blocks[-1]) < BLOCK_SIZE:
+            room = BLOCK_SIZE - len(self._blocks[-1])
+            self._blocks[-1].extend(items[:room])
+            items = items[room:]
+        self._blocks.extend(self._chunks(items))
+
+    def pop(self, index: int = -1):
+        b, offset = self._locate(index)
+        value = self._blocks[b].pop(offset)
+        if not self._blocks[b]:
+            del self._blocks[b]
+        self._len -= 1
+        self.version += 1
+        return value
+
+    def clear(self):
+        self._blocks = []
+        self._len = 0
+        self.version += 1